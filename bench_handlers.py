@@ -0,0 +1,258 @@
+"""Нагрузочный тест обработчиков бота без сети.
+
+Обновления Telegram собираются вручную и проходят через то же приложение,
+что и в боте (build_application), а запросы к Bot API принимает локальный
+FakeRequest: он записывает вызовы и сразу отвечает. Для каждого обработчика
+печатаются пропускная способность и задержки p50/p95/p99, результаты
+сохраняются в JSON для сравнения между версиями.
+
+Очереди и файлы создаются во временном каталоге, рабочие данные бота не трогаются.
+
+Запуск: python bench_handlers.py [--sizes 10 1000 100000] [--concurrency 1 16 64]
+                                 [--requests 500] [--api-latency 0] [--output bench_handlers.json]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': "Queue bot", 'username': "queue_bot"}
+# Новые студенты получают ID после заранее заполненной очереди
+NEW_USER_BASE = 10 ** 9
+
+
+class FakeRequest(BaseRequest):
+    """HTTP-клиент бота без сети: записывает вызовы Bot API и возвращает правдоподобные ответы"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = {}
+        self._message_ids = itertools.count(1)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        params = request_data.parameters if request_data else {}
+        if api_method == 'getMe':
+            result = BOT_USER
+        elif api_method in ('sendMessage', 'editMessageText'):
+            result = {
+                'message_id': params.get('message_id') or next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': int(params.get('chat_id', 0)), 'type': 'private'},
+                'from': BOT_USER,
+                'text': params.get('text', ""),
+            }
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode('utf-8')
+
+
+class UpdateFactory:
+    """Синтетические обновления Telegram в формате Bot API"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._ids = itertools.count(1)
+
+    def _user(self, user_id: int):
+        return {'id': user_id, 'is_bot': False, 'first_name': f"Студент{user_id}", 'username': f"student{user_id}"}
+
+    def message(self, user_id: int, text: str) -> Update:
+        message = {
+            'message_id': next(self._ids),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self._user(user_id),
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return Update.de_json({'update_id': next(self._ids), 'message': message}, self.bot)
+
+    def callback(self, user_id: int, data: str) -> Update:
+        message = {
+            'message_id': next(self._ids),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': BOT_USER,
+            'text': "…",
+        }
+        query = {
+            'id': str(next(self._ids)),
+            'from': self._user(user_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': message,
+        }
+        return Update.de_json({'update_id': next(self._ids), 'callback_query': query}, self.bot)
+
+
+def percentile(values, p: float) -> float:
+    """Перцентиль по отсортированному списку (ближайший ранг)"""
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+async def dispatch(application, updates, concurrency: int):
+    """Обработка обновлений concurrency параллельными потоками; задержка каждого в секундах"""
+    latencies = []
+    pending = iter(updates)
+
+    async def worker():
+        for update in pending:
+            started = time.perf_counter()
+            await application.process_update(update)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - started
+
+
+def scenarios(factory, admin_id: int, lab: str, size: int, count: int, offset: int):
+    """Сценарии по обработчикам: имя и список обновлений.
+
+    join и surname идут подряд: фамилию вводят те же студенты, что только что
+    нажали /join, поэтому очередь растёт на count, а next затем возвращает её к size.
+    """
+    key = f"lab_{lab}"
+    new_users = range(NEW_USER_BASE + offset, NEW_USER_BASE + offset + count)
+    members = [1 + (i * 7919) % size for i in range(count)] if size else [NEW_USER_BASE] * count
+    return [
+        ('start', [factory.message(user_id, "/start") for user_id in new_users]),
+        ('join_queue', [factory.message(user_id, f"/join {lab}") for user_id in new_users]),
+        ('handle_surname_input', [factory.message(user_id, f"Фамилия{user_id}") for user_id in new_users]),
+        ('show_queue', [factory.message(user_id, f"/queue {lab}") for user_id in members]),
+        ('get_position', [factory.message(user_id, f"/position {lab}") for user_id in members]),
+        ('button_handler', [
+            factory.callback(user_id, f"queue|{key}|2" if i % 2 else f"position|{key}")
+            for i, user_id in enumerate(members)
+        ]),
+        ('next_student', [factory.message(admin_id, f"/next {lab}") for _ in range(count)]),
+    ]
+
+
+def prefill(bot, key: str, size: int):
+    """Запись очереди из size студентов прямо в хранилище"""
+    storage = bot.make_storage(key)
+    storage.write([], [
+        {'user_id': user_id, 'username': f"@student{user_id}", 'first_name': f"Студент{user_id}",
+         'surname': f"Фамилия{user_id}"}
+        for user_id in range(1, size + 1)
+    ])
+    storage.close()
+
+
+async def run(bot, args):
+    request = FakeRequest(args.api_latency / 1000)
+    application = bot.build_application("1:bench", request=request, get_updates_request=FakeRequest())
+    factory = UpdateFactory(application.bot)
+    results = []
+
+    async with application:
+        await application.post_init(application)
+        offset = 0
+        for size in args.sizes:
+            for concurrency in args.concurrency:
+                # Каждый прогон работает со своей очередью заданного размера
+                lab = f"bench{size}c{concurrency}"
+                prefill(bot, f"lab_{lab}", size)
+                for name, updates in scenarios(factory, bot.ADMIN_ID, lab, size, args.requests, offset):
+                    calls_before = sum(request.calls.values())
+                    latencies, elapsed = await dispatch(application, updates, concurrency)
+                    # Отправка ответов идёт в фоне и в задержку обработчика не входит
+                    drain_started = time.perf_counter()
+                    await bot.outbox.drain()
+                    drain = time.perf_counter() - drain_started
+
+                    latencies.sort()
+                    result = {
+                        'handler': name,
+                        'queue_size': size,
+                        'concurrency': concurrency,
+                        'requests': len(latencies),
+                        'throughput': len(latencies) / elapsed,
+                        'p50_ms': percentile(latencies, 50) * 1000,
+                        'p95_ms': percentile(latencies, 95) * 1000,
+                        'p99_ms': percentile(latencies, 99) * 1000,
+                        'max_ms': latencies[-1] * 1000,
+                        'drain_ms': drain * 1000,
+                        'api_calls': sum(request.calls.values()) - calls_before,
+                    }
+                    results.append(result)
+                    print(
+                        f"{size:>8} {concurrency:>5} {name:>22} {result['throughput']:>10.0f} "
+                        f"{result['p50_ms']:>8.3f} {result['p95_ms']:>8.3f} {result['p99_ms']:>8.3f} "
+                        f"{result['api_calls']:>7}"
+                    )
+                offset += args.requests
+        await application.post_stop(application)
+        await application.post_shutdown(application)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест обработчиков бота без сети")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1_000, 100_000],
+                        help="размеры очереди перед прогоном")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16, 64],
+                        help="сколько обновлений обрабатывается одновременно")
+    parser.add_argument('--requests', type=int, default=500, help="обновлений на обработчик")
+    parser.add_argument('--api-latency', type=float, default=0.0, help="задержка ответа Bot API, мс")
+    parser.add_argument('--output', default='bench_handlers.json', help="файл с результатами (JSON)")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+
+    # Бот пишет очереди и табло в текущий каталог, поэтому работаем во временном.
+    # Лимиты отправки и защиту от флуда снимаем: иначе время уйдёт на ожидание токенов,
+    # а повторные запросы одних и тех же студентов будут отброшены
+    os.chdir(tempfile.mkdtemp(prefix="queue_bot_bench_"))
+    os.environ.update({
+        'SEND_RATE_GLOBAL': "1e9", 'SEND_RATE_PER_CHAT': "1e9", 'OUTBOX_MAX_SIZE': "1000000", 'METRICS_PORT': "0",
+        'FLOOD_MUTATE_RATE': "1e9", 'FLOOD_VIEW_RATE': "1e9",
+    })
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main as bot
+    logging.getLogger().setLevel(logging.WARNING)
+
+    print(f"{'размер':>8} {'потоки':>5} {'обработчик':>22} {'обн./с':>10} "
+          f"{'p50, мс':>8} {'p95, мс':>8} {'p99, мс':>8} {'запросы':>7}")
+    results = asyncio.run(run(bot, args))
+
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'config': {
+                'sizes': args.sizes,
+                'concurrency': args.concurrency,
+                'requests': args.requests,
+                'api_latency_ms': args.api_latency,
+                'storage': bot.QUEUE_STORAGE,
+                'python': platform.python_version(),
+            },
+            'results': results,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"Результаты записаны в {output}")
+
+
+if __name__ == '__main__':
+    main()
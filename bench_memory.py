@@ -0,0 +1,106 @@
+"""Бенчмарк памяти и выделений: записи очереди словарями (как в queue.json) против Student.
+
+Запуск: python bench_memory.py [размер ...]
+"""
+import gc
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+from main import StudentQueue
+from storage import QueueStorage
+from student import Student, display_name
+
+FIRST_NAMES = ["Иван", "Анна", "Мария", "Алексей", "Дмитрий", "Елена", "Сергей", "Ольга", "Павел", "Наталья"]
+
+
+class NullStorage(QueueStorage):
+    """Хранилище, которое ничего не хранит"""
+
+    def load(self):
+        return [], []
+
+    def write(self, records, snapshot):
+        pass
+
+
+def roster_json(size: int) -> bytes:
+    """queue.json на size студентов: имена и фамилии повторяются, username у каждого свой"""
+    rng = random.Random(42)
+    return json.dumps([
+        {'user_id': user_id, 'username': f"user{user_id}",
+         'first_name': rng.choice(FIRST_NAMES), 'surname': f"Фамилия{rng.randrange(max(size // 20, 1))}"}
+        for user_id in range(size)
+    ], ensure_ascii=False).encode('utf-8')
+
+
+def traced(build):
+    """Результат build(), удерживаемая им память, пик во время построения и число живых блоков"""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+    tracemalloc.stop()
+    return result, current, peak, blocks
+
+
+def per_call(func, repeat: int) -> float:
+    """Среднее время вызова в микросекундах"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def measure(size: int):
+    """Память и время операций для очереди из size студентов"""
+    data = roster_json(size)
+    dicts, dict_bytes, dict_peak, dict_blocks = traced(lambda: json.loads(data))
+    students, student_bytes, student_peak, student_blocks = traced(
+        lambda: [Student.from_dict(item) for item in json.loads(data)]
+    )
+
+    def load_queue():
+        queue = StudentQueue(NullStorage())
+        queue._rebuild([Student.from_dict(item) for item in json.loads(data)])
+        # Индекс имён строится при первом поиске; учитываем и его
+        queue.find("ф")
+        return queue
+    queue, queue_bytes, queue_peak, queue_blocks = traced(load_queue)
+
+    print(f"Очередь из {size} студентов")
+    print(f"{'':>26} {'память, МБ':>11} {'пик, МБ':>9} {'байт/запись':>12} {'блоков':>9}")
+    for name, current, peak, blocks in (
+        ("словари queue.json", dict_bytes, dict_peak, dict_blocks),
+        ("Student", student_bytes, student_peak, student_blocks),
+        ("StudentQueue с индексами", queue_bytes, queue_peak, queue_blocks),
+    ):
+        print(f"{name:>26} {current / 2**20:>11.1f} {peak / 2**20:>9.1f} {current / size:>12.0f} {blocks:>9}")
+
+    # Прежние обработчики копировали очередь ради длины и пересчитывали имена при каждом показе
+    repeat = 1000
+    page = dicts[:25]
+    print(f"{'':>26} {'было, мкс':>11} {'стало, мкс':>11}")
+    for name, old, new in (
+        ("длина очереди", lambda: len(list(dicts)), lambda: len(queue)),
+        ("имена страницы /queue",
+         lambda: [display_name(s.get('surname', ''), s.get('first_name', ''), s.get('username', '')) for s in page],
+         lambda: [s.display_name for s in queue.get_page(0, 25)]),
+    ):
+        print(f"{name:>26} {per_call(old, repeat):>11.2f} {per_call(new, repeat):>11.2f}")
+    print()
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [100_000]
+    for size in sizes:
+        # Данные каждого размера освобождаются при выходе из measure и не мешают следующему замеру
+        measure(size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""Микробенчмарк очереди: индексированная StudentQueue против старой реализации на deque.
+
+Запуск: python bench_queue.py [размер ...]
+"""
+import random
+import sys
+import time
+from collections import deque
+
+from main import StudentQueue
+from storage import QueueStorage
+from student import Student
+
+
+class DequeStudentQueue:
+    """Прежняя реализация очереди на deque с линейными проходами (без записи на диск)"""
+
+    def __init__(self):
+        self.queue = deque()
+
+    def load(self, students):
+        self.queue = deque(students)
+
+    def add_student(self, user_id, username, first_name, surname=""):
+        for existing_student in self.queue:
+            if existing_student['user_id'] == user_id:
+                return False
+        self.queue.append({
+            'user_id': user_id,
+            'username': username,
+            'first_name': first_name,
+            'surname': surname
+        })
+        return True
+
+    def remove_student(self, user_id):
+        for i, student in enumerate(self.queue):
+            if student['user_id'] == user_id:
+                del self.queue[i]
+                return True
+        return False
+
+    def remove_first(self):
+        if self.queue:
+            return self.queue.popleft()
+        return None
+
+    def get_position(self, user_id):
+        for i, student in enumerate(self.queue):
+            if student['user_id'] == user_id:
+                return i + 1
+        return None
+
+
+class NullStorage(QueueStorage):
+    """Хранилище, которое ничего не хранит"""
+
+    def load(self):
+        return [], []
+
+    def write(self, records, snapshot):
+        pass
+
+
+class MemoryStudentQueue(StudentQueue):
+    """StudentQueue без диска, чтобы измерять только работу индексов"""
+
+    def __init__(self):
+        super().__init__(NullStorage())
+
+    def _persist(self, record):
+        pass
+
+    def load(self, students):
+        self._rebuild([Student.from_dict(student) for student in students])
+
+
+def fill(queue, size):
+    # Заполняем напрямую: у старой реализации цикл add_student занял бы O(n^2)
+    queue.load([
+        {'user_id': user_id, 'username': f"@user{user_id}", 'first_name': f"Имя{user_id}", 'surname': f"Фамилия{user_id}"}
+        for user_id in range(size)
+    ])
+
+
+def measure(queue, size, ops):
+    """Среднее время операций в микросекундах при постоянном размере очереди"""
+    rng = random.Random(42)
+    next_id = size
+    results = {}
+
+    start = time.perf_counter()
+    for _ in range(ops):
+        queue.get_position(rng.randrange(next_id - size, next_id))
+    results['position'] = (time.perf_counter() - start) / ops * 1e6
+
+    start = time.perf_counter()
+    for _ in range(ops):
+        user_id = rng.randrange(next_id - size, next_id)
+        queue.remove_student(user_id)
+        queue.add_student(user_id, "@user", "Имя", "Фамилия")
+    results['leave+join'] = (time.perf_counter() - start) / ops * 1e6
+
+    start = time.perf_counter()
+    for _ in range(ops):
+        queue.remove_first()
+        queue.add_student(next_id, "@user", "Имя", "Фамилия")
+        next_id += 1
+    results['next+join'] = (time.perf_counter() - start) / ops * 1e6
+    return results
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10, 1_000, 100_000]
+    print(f"{'размер':>8} {'операция':>12} {'deque, мкс':>12} {'индекс, мкс':>12} {'ускорение':>10}")
+    for size in sizes:
+        # Для большой очереди старая реализация слишком медленная, поэтому операций меньше
+        ops = 200 if size >= 10_000 else 2_000
+        old_queue, new_queue = DequeStudentQueue(), MemoryStudentQueue()
+        fill(old_queue, size)
+        fill(new_queue, size)
+        old = measure(old_queue, size, ops)
+        new = measure(new_queue, size, ops)
+        for name in old:
+            print(f"{size:>8} {name:>12} {old[name]:>12.2f} {new[name]:>12.2f} {old[name] / new[name]:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
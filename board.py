@@ -0,0 +1,140 @@
+"""Живое табло очереди: одно закреплённое сообщение, которое бот редактирует сам"""
+import asyncio
+import json
+import logging
+import os
+import time
+
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, TelegramError
+
+from edit_cache import fingerprint
+from outbox import OutboxFull, PRIORITY_NORMAL
+
+logger = logging.getLogger(__name__)
+
+
+class LiveBoards:
+    """Табло очередей по чатам.
+
+    После изменения очереди табло обновляется не чаще одного раза в interval
+    секунд и только если отрисованный текст действительно изменился: сколько бы
+    студентов ни смотрело на очередь, на одно изменение уходит не больше одного
+    запроса к Telegram.
+    """
+
+    def __init__(self, render, outbox, filename: str, interval: float = 3.0):
+        # render(key) -> (текст, клавиатура) для табло очереди key
+        self.render = render
+        # Запросы к Telegram идут через общую очередь отправки
+        self.outbox = outbox
+        self.filename = filename
+        self.interval = interval
+        self._boards = self._load()
+        self._last_sent = {}
+        self._last_edit = {}
+        self._scheduled = {}
+
+    def _load(self):
+        try:
+            if os.path.exists(self.filename):
+                with open(self.filename, 'r', encoding='utf-8') as f:
+                    return {int(chat_id): board for chat_id, board in json.load(f).items()}
+        except Exception as e:
+            logger.error(f"Ошибка загрузки табло: {e}")
+        return {}
+
+    def _save(self):
+        try:
+            with open(self.filename, 'w', encoding='utf-8') as f:
+                json.dump(self._boards, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения табло: {e}")
+
+    async def create(self, chat_id: int, key: str):
+        """Отправить и закрепить табло очереди key в чате chat_id.
+
+        Возвращает None или ошибку, из-за которой табло не создано; прежнее табло
+        чата в этом случае остаётся.
+        """
+        text, reply_markup = self.render(key)
+        try:
+            message = await self.outbox.send(chat_id, text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+        except (TelegramError, OutboxFull) as e:
+            logger.warning(f"Не удалось отправить табло в чат {chat_id}: {e}")
+            return e
+        try:
+            await self.outbox.submit(
+                chat_id, 'pin_chat_message', PRIORITY_NORMAL,
+                chat_id=chat_id, message_id=message.message_id, disable_notification=True
+            )
+        except (TelegramError, OutboxFull) as e:
+            # Обычно у бота нет права закреплять сообщения; незакреплённое табло не регистрируем
+            logger.warning(f"Не удалось закрепить табло в чате {chat_id}: {e}")
+            self.outbox.submit(chat_id, 'delete_message', PRIORITY_NORMAL, chat_id=chat_id, message_id=message.message_id)
+            return e
+
+        await self.remove(chat_id)
+        self._boards[chat_id] = {'key': key, 'message_id': message.message_id}
+        self._last_sent[chat_id] = fingerprint(text, reply_markup)
+        self._last_edit[chat_id] = time.monotonic()
+        self._save()
+
+    async def remove(self, chat_id: int):
+        """Отключить табло в чате"""
+        board = self._boards.pop(chat_id, None)
+        if board is None:
+            return False
+        self._save()
+        self._last_sent.pop(chat_id, None)
+        task = self._scheduled.pop(chat_id, None)
+        if task is not None:
+            task.cancel()
+        try:
+            await self.outbox.submit(
+                chat_id, 'unpin_chat_message', PRIORITY_NORMAL, chat_id=chat_id, message_id=board['message_id']
+            )
+        except (TelegramError, OutboxFull):
+            pass
+        return True
+
+    def changed(self, key: str):
+        """Очередь key изменилась: запланировать обновление её табло"""
+        if self.outbox.bot is None:
+            return
+        for chat_id, board in self._boards.items():
+            if board['key'] != key or chat_id in self._scheduled:
+                continue
+            delay = max(0.0, self._last_edit.get(chat_id, 0.0) + self.interval - time.monotonic())
+            self._scheduled[chat_id] = asyncio.get_running_loop().create_task(self._update_later(chat_id, delay))
+
+    async def _update_later(self, chat_id: int, delay: float):
+        await asyncio.sleep(delay)
+        # Изменения, пришедшие во время запроса, запланируют следующее обновление
+        self._scheduled.pop(chat_id, None)
+        board = self._boards.get(chat_id)
+        if board is None:
+            return
+
+        text, reply_markup = self.render(board['key'])
+        digest = fingerprint(text, reply_markup)
+        if self._last_sent.get(chat_id) == digest:
+            return
+
+        self._last_edit[chat_id] = time.monotonic()
+        try:
+            await self.outbox.submit(
+                chat_id, 'edit_message_text', PRIORITY_NORMAL, text=text, chat_id=chat_id,
+                message_id=board['message_id'], reply_markup=reply_markup, parse_mode=ParseMode.HTML
+            )
+            self._last_sent[chat_id] = digest
+        except BadRequest as e:
+            if "not found" in str(e):
+                # Сообщение удалили вручную — табло больше нет
+                logger.info(f"Табло в чате {chat_id} удалено, отключаем")
+                self._boards.pop(chat_id, None)
+                self._save()
+            else:
+                logger.error(f"Не удалось обновить табло в чате {chat_id}: {e}")
+        except (TelegramError, OutboxFull) as e:
+            logger.error(f"Не удалось обновить табло в чате {chat_id}: {e}")
@@ -0,0 +1,82 @@
+"""Проверка однократного переноса queue.json в базу SQLite.
+
+Очередь из queue.json переносится в новую базу, затем опустошается — очисткой
+(как /clear) или вызовом всех студентов по одному (remove_first, как /next).
+После переоткрытия база должна остаться пустой: перенос не повторяется. Так же
+проверяется база, созданная до появления отметки об импорте.
+
+Запуск: python check_storage.py
+"""
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+
+STUDENTS = 10
+
+
+def write_roster(path: str):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump([
+            {'user_id': user_id, 'username': f"user{user_id}", 'first_name': "Имя", 'surname': f"Фамилия{user_id}"}
+            for user_id in range(1, STUDENTS + 1)
+        ], f, ensure_ascii=False)
+
+
+def reopen(storage_class, queue_class, db: str, roster: str):
+    """Очередь из базы db, как при запуске бота; длина и сама очередь"""
+    queue = queue_class(storage_class(db, import_file=roster))
+    return len(queue), queue
+
+
+def run(directory: str):
+    from main import StudentQueue
+    from storage import SQLiteStorage
+
+    roster = os.path.join(directory, "queue.json")
+    write_roster(roster)
+    checks = []
+
+    for name, drain in (
+        ("после очистки", lambda queue: queue.clear()),
+        ("после вызова всех по /next", lambda queue: [queue.remove_first() for _ in range(len(queue))]),
+    ):
+        db = os.path.join(directory, f"{len(checks)}.sqlite3")
+        loaded, queue = reopen(SQLiteStorage, StudentQueue, db, roster)
+        checks.append((f"перенос из queue.json ({name})", loaded, STUDENTS))
+        drain(queue)
+        queue.storage.close()
+        loaded, queue = reopen(SQLiteStorage, StudentQueue, db, roster)
+        queue.storage.close()
+        checks.append((f"очередь пуста {name}", loaded, 0))
+
+    # База прежней версии: таблица уже есть и пуста, отметки об импорте нет
+    db = os.path.join(directory, "old.sqlite3")
+    SQLiteStorage(db).close()
+    with sqlite3.connect(db) as conn:
+        conn.execute("PRAGMA user_version = 0")
+    loaded, queue = reopen(SQLiteStorage, StudentQueue, db, roster)
+    queue.storage.close()
+    checks.append(("старая пустая база не импортирует заново", loaded, 0))
+    return checks
+
+
+def main():
+    os.environ.setdefault('METRICS_PORT', "0")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory(prefix="queue_bot_storage_") as directory:
+        # Бот создаёт свои файлы в текущем каталоге, поэтому работаем во временном
+        os.chdir(directory)
+        checks = run(directory)
+
+    failed = False
+    for name, got, expected in checks:
+        ok = got == expected
+        failed |= not ok
+        print(f"{'OK  ' if ok else 'FAIL'} {name}: {got} (ожидалось {expected})")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Проверка режима webhook от HTTP-запроса до ответа бота.
+
+Запускает приложение бота (build_application) с WebhookReceiver на свободном
+порту и отправляет ему обновления обычным HTTP-клиентом, как это делает Telegram.
+Запросы к Bot API принимает FakeRequest из bench_handlers, сеть не нужна.
+Проверяется, что запрос без секрета или с чужим секретом отклоняется (403),
+некорректное тело — 400, а обновление с верным секретом принимается (200)
+и обрабатывается: бот отвечает на /start. Для защиты сервера: слишком длинная
+строка запроса — 400, слишком длинный или многочисленные заголовки — 431,
+молчащий клиент отключается по таймауту.
+
+Запуск: python check_webhook.py
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+SECRET = "check-webhook-secret"
+PATH = "/telegram"
+
+
+def post(port: int, body: bytes, secret: str = None) -> int:
+    """POST на webhook; возвращает HTTP-код ответа"""
+    request = urllib.request.Request(f"http://127.0.0.1:{port}{PATH}", data=body, method='POST',
+                                     headers={'Content-Type': "application/json"})
+    if secret is not None:
+        request.add_header('X-Telegram-Bot-Api-Secret-Token', secret)
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def raw(port: int, data: bytes, timeout: float = 5):
+    """Отправка произвольных байтов; HTTP-код ответа или None, если сервер закрыл соединение молча"""
+    with socket.create_connection(("127.0.0.1", port), timeout=timeout) as conn:
+        conn.sendall(data)
+        response = conn.recv(1024)
+    return int(response.split()[1]) if response else None
+
+
+def start_update(user_id: int) -> bytes:
+    message = {
+        'message_id': 1,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': "Студент", 'username': f"student{user_id}"},
+        'text': "/start",
+        'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}],
+    }
+    return json.dumps({'update_id': 1, 'message': message}).encode('utf-8')
+
+
+async def run(bot):
+    from bench_handlers import FakeRequest
+    from webhook import WebhookReceiver, serve_webhook
+
+    api = FakeRequest()
+    application = bot.build_application("1:check", request=api, get_updates_request=FakeRequest())
+    receiver = WebhookReceiver(application, "127.0.0.1", 0, PATH, SECRET)
+    stop = asyncio.Event()
+    serving = asyncio.create_task(serve_webhook(application, receiver, stop=stop))
+    # Порт 0: сервер выбирает свободный порт и записывает его после запуска
+    while not receiver.server.port and not serving.done():
+        await asyncio.sleep(0.01)
+
+    port = receiver.server.port
+    receiver.server.timeout = 0.5
+    headers = b''.join(b'X-%d: 1\r\n' % i for i in range(receiver.server.max_headers + 1))
+    checks = [
+        ("длинная строка запроса", await asyncio.to_thread(raw, port, b'POST /' + b'a' * 70000 + b' HTTP/1.1\r\n'), 400),
+        ("длинный заголовок", await asyncio.to_thread(
+            raw, port, b'POST ' + PATH.encode() + b' HTTP/1.1\r\nX: ' + b'a' * 70000 + b'\r\n\r\n'), 431),
+        ("много заголовков", await asyncio.to_thread(
+            raw, port, b'POST ' + PATH.encode() + b' HTTP/1.1\r\n' + headers + b'\r\n'), 431),
+        ("молчащий клиент отключён", await asyncio.to_thread(raw, port, b'POST ' + PATH.encode()), None),
+        ("без секрета", await asyncio.to_thread(post, port, start_update(100)), 403),
+        ("чужой секрет", await asyncio.to_thread(post, port, start_update(100), "wrong"), 403),
+        ("некорректное тело", await asyncio.to_thread(post, port, b'{not json', SECRET), 400),
+        ("верный секрет", await asyncio.to_thread(post, port, start_update(100), SECRET), 200),
+    ]
+    # Ответ бота уходит через очередь отправки; ждём его не дольше пяти секунд
+    deadline = time.monotonic() + 5
+    while not api.calls.get('sendMessage') and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    checks.append(("обновление обработано", min(api.calls.get('sendMessage', 0), 1), 1))
+
+    stop.set()
+    await serving
+    return checks
+
+
+def main():
+    # Бот пишет очереди и табло в текущий каталог, поэтому работаем во временном
+    os.chdir(tempfile.mkdtemp(prefix="queue_bot_webhook_"))
+    os.environ.update({'METRICS_PORT': "0", 'BOT_MODE': "webhook", 'WEBHOOK_SECRET': SECRET})
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main as bot
+    logging.getLogger().setLevel(logging.WARNING)
+
+    failed = False
+    for name, got, expected in asyncio.run(run(bot)):
+        ok = got == expected
+        failed |= not ok
+        print(f"{'OK  ' if ok else 'FAIL'} {name}: {got} (ожидалось {expected})")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
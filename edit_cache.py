@@ -0,0 +1,46 @@
+"""Отпечатки отправленных сообщений: правка без изменений не уходит в Telegram"""
+import hashlib
+import json
+from collections import OrderedDict
+
+
+def fingerprint(text: str, reply_markup) -> bytes:
+    """Хеш текста и клавиатуры сообщения"""
+    markup = json.dumps(reply_markup.to_dict() if reply_markup else None, sort_keys=True, ensure_ascii=False)
+    return hashlib.blake2b(f"{text}\0{markup}".encode('utf-8'), digest_size=16).digest()
+
+
+class EditCache:
+    """Последний отправленный вид сообщений по (chat_id, message_id).
+
+    Хранится не больше max_size отпечатков, давно не использованные вытесняются;
+    для вытесненного сообщения правка просто будет отправлена.
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._sent = OrderedDict()
+
+    def __len__(self):
+        return len(self._sent)
+
+    def changed(self, chat_id: int, message_id: int, text: str, reply_markup) -> bool:
+        """Отличается ли новый вид сообщения от отправленного; новый вид запоминается"""
+        key = (chat_id, message_id)
+        digest = fingerprint(text, reply_markup)
+        if self._sent.get(key) == digest:
+            self._sent.move_to_end(key)
+            return False
+        self.remember(chat_id, message_id, digest)
+        return True
+
+    def remember(self, chat_id: int, message_id: int, digest: bytes):
+        key = (chat_id, message_id)
+        self._sent[key] = digest
+        self._sent.move_to_end(key)
+        while len(self._sent) > self.max_size:
+            self._sent.popitem(last=False)
+
+    def forget(self, chat_id: int, message_id: int):
+        """Вид сообщения неизвестен (правка не удалась)"""
+        self._sent.pop((chat_id, message_id), None)
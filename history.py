@@ -0,0 +1,189 @@
+"""История событий очередей: журнал только на дописывание с ротацией сегментов"""
+import asyncio
+import csv
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_RE = re.compile(r'^events-(\d{6})\.jsonl$')
+
+# Подписи событий в выгрузке
+EVENT_NAMES = {
+    'join': "встал в очередь",
+    'import': "добавлен списком",
+    'leave': "вышел",
+    'next': "сдал",
+    'remove': "удалён преподавателем",
+    'move': "перемещён",
+    'clear': "удалён при очистке",
+    'shuffle': "очередь перемешана",
+}
+CSV_HEADER = ("время", "очередь", "событие", "user_id", "студент")
+
+
+def csv_row(event: dict):
+    """Строка выгрузки для события журнала"""
+    return (
+        datetime.fromtimestamp(event['ts']).isoformat(sep=' ', timespec='seconds'),
+        event.get('queue', ""),
+        EVENT_NAMES.get(event.get('event'), event.get('event')),
+        "" if event.get('user_id') is None else event['user_id'],
+        event.get('name', ""),
+    )
+
+
+class EventLog:
+    """Журнал событий в файлах JSON Lines events-NNNNNN.jsonl в каталоге directory.
+
+    Когда сегмент дорастает до segment_bytes, начинается следующий; если задан
+    max_segments, самые старые сегменты удаляются. События копятся в памяти и
+    дописываются в отдельном потоке не реже раза в max_delay секунд. Чтение идёт
+    построчно по сегментам, поэтому память не зависит от длины истории.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 4 << 20, max_segments: int = 0, max_delay: float = 1.0):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        self.max_delay = max_delay
+        self._buffer = []
+        self._timer = None
+        self._file = None
+        self._number = 0
+        # Один поток: дописывание и чтение сегментов не пересекаются
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history")
+
+    def record(self, queue: str, event: str, student=None):
+        """Добавить событие очереди queue; student — запись Student или None"""
+        self._buffer.append(json.dumps({
+            'ts': round(time.time(), 3),
+            'queue': queue,
+            'event': event,
+            'user_id': student.user_id if student is not None else None,
+            'name': student.display_name if student is not None else "",
+        }, ensure_ascii=False, separators=(',', ':')))
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Вне event loop (скрипты) пишем сразу
+            self._write(self._take())
+            return
+        if self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush)
+
+    def _take(self):
+        lines, self._buffer = self._buffer, []
+        return lines
+
+    def _flush(self):
+        """Отправка накопленных событий в поток записи"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._buffer:
+            return self._executor.submit(self._write, self._take())
+        return None
+
+    def _segments(self):
+        """Номера существующих сегментов по возрастанию"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(int(match.group(1)) for match in map(SEGMENT_RE.match, names) if match)
+
+    def _path(self, number: int) -> str:
+        return os.path.join(self.directory, f"events-{number:06d}.jsonl")
+
+    def _open(self, number: int):
+        self._file = open(self._path(number), 'ab')
+        self._number = number
+
+    def _write(self, lines):
+        """Дописывание пачки событий; выполняется в потоке журнала"""
+        if not lines:
+            return
+        data = "".join(line + "\n" for line in lines).encode('utf-8')
+        try:
+            if self._file is None:
+                os.makedirs(self.directory, exist_ok=True)
+                segments = self._segments()
+                self._open(segments[-1] if segments else 1)
+            if self._file.tell() and self._file.tell() + len(data) > self.segment_bytes:
+                self._rotate()
+            self._file.write(data)
+            self._file.flush()
+        except OSError as e:
+            logger.error(f"Ошибка записи истории очередей: {e}")
+
+    def _rotate(self):
+        self._file.close()
+        self._open(self._number + 1)
+        if self.max_segments:
+            for number in self._segments()[:-self.max_segments]:
+                os.remove(self._path(number))
+
+    def events(self, since: float = None, until: float = None, queue: str = None):
+        """События с since <= ts < until (и только очереди queue, если задана) по порядку записи"""
+        for number in self._segments():
+            path = self._path(number)
+            # Сегмент, изменённый последний раз раньше since, целиком старше окна
+            try:
+                if since is not None and os.path.getmtime(path) < since:
+                    continue
+                f = open(path, 'rb')
+            except FileNotFoundError:
+                continue
+            with f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue
+                    ts = event.get('ts', 0)
+                    if since is not None and ts < since:
+                        continue
+                    # События записываются по времени: дальше будут только более поздние
+                    if until is not None and ts >= until:
+                        return
+                    if queue is None or event.get('queue') == queue:
+                        yield event
+
+    def _export(self, path: str, since, until, queue, max_bytes):
+        rows, complete = 0, True
+        with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.writer(f)
+            writer.writerow(CSV_HEADER)
+            for row in map(csv_row, self.events(since, until, queue)):
+                # tell() у текстового файла сбрасывает буфер, поэтому размер проверяется раз в 1000 строк
+                if max_bytes and rows % 1000 == 0 and f.tell() > max_bytes:
+                    complete = False
+                    break
+                writer.writerow(row)
+                rows += 1
+        return rows, complete
+
+    async def export_csv(self, path: str, since: float = None, until: float = None, queue: str = None,
+                         max_bytes: int = None):
+        """Выгрузка отфильтрованных событий в CSV-файл path: (число строк, выгружено ли всё)"""
+        # Сначала дописываем накопленное: поток один, поэтому выгрузка увидит эти события
+        self._flush()
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, self._export, path, since, until, queue, max_bytes
+        )
+
+    async def close(self):
+        """Дописать накопленные события и закрыть сегмент, не блокируя event loop"""
+        self._flush()
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._close)
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,149 @@
+"""Небольшой HTTP-сервер на asyncio для служебных запросов бота"""
+import asyncio
+import logging
+from urllib.parse import urlsplit, parse_qs
+
+logger = logging.getLogger(__name__)
+
+REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+           405: "Method Not Allowed", 413: "Payload Too Large", 431: "Request Header Fields Too Large",
+           500: "Internal Server Error"}
+
+
+class HttpRequest:
+    """Разобранный запрос: метод, путь, параметры, заголовки (в нижнем регистре) и тело"""
+
+    __slots__ = ('method', 'path', 'query', 'headers', 'body')
+
+    def __init__(self, method: str, target: str, headers: dict, body: bytes):
+        url = urlsplit(target)
+        self.method = method
+        self.path = url.path
+        self.query = parse_qs(url.query)
+        self.headers = headers
+        self.body = body
+
+
+class HttpServer:
+    """HTTP/1.1 с keep-alive, без внешних зависимостей.
+
+    Обработчик маршрута — корутина handler(request) -> (статус, content-type, тело).
+    Запросы одного соединения обрабатываются по очереди, соединения — параллельно.
+    Сервер может быть открыт в интернет (webhook), поэтому запрос должен прийти
+    целиком за timeout секунд, а заголовков не больше max_headers и max_header_bytes
+    байт вместе со строкой запроса; иначе соединение закрывается.
+    """
+
+    def __init__(self, host: str, port: int, max_body: int = 1 << 20, timeout: float = 10.0,
+                 max_headers: int = 100, max_header_bytes: int = 16 << 10):
+        self.host = host
+        self.port = port
+        self.max_body = max_body
+        self.timeout = timeout
+        self.max_headers = max_headers
+        self.max_header_bytes = max_header_bytes
+        self._routes = {}
+        self._server = None
+
+    def route(self, method: str, path: str, handler):
+        """Назначить обработчик запросам method на path"""
+        self._routes[(method, path)] = handler
+
+    async def start(self):
+        # limit — наибольшая длина строки для readline: более длинная строка вызывает ValueError
+        self._server = await asyncio.start_server(self._serve, self.host, self.port, limit=self.max_header_bytes)
+        # При порте 0 система выбирает свободный; запоминаем фактический
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"HTTP-сервер слушает {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                try:
+                    # Медленный или молчащий клиент не держит соединение дольше timeout
+                    request = await asyncio.wait_for(self._read_request(reader, writer), self.timeout)
+                except asyncio.TimeoutError:
+                    break
+                if request is None:
+                    break
+                status, content_type, body = await self._dispatch(request)
+                keep_alive = request.headers.get('connection', "").lower() != "close"
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + body
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader, writer):
+        """Чтение одного запроса; None — соединение закрыто или запрос некорректен"""
+        try:
+            request_line = await reader.readline()
+        except ValueError:
+            # Строка запроса длиннее лимита буфера
+            await self._reject(writer, 400)
+            return None
+        if not request_line:
+            return None
+        try:
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+        except ValueError:
+            await self._reject(writer, 400)
+            return None
+
+        headers = {}
+        count, size = 0, len(request_line)
+        while True:
+            try:
+                line = await reader.readline()
+            except ValueError:
+                await self._reject(writer, 431)
+                return None
+            if line in (b'\r\n', b'\n', b''):
+                break
+            count += 1
+            size += len(line)
+            if count > self.max_headers or size > self.max_header_bytes:
+                await self._reject(writer, 431)
+                return None
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            await self._reject(writer, 400)
+            return None
+        if length > self.max_body:
+            await self._reject(writer, 413)
+            return None
+        body = await reader.readexactly(length) if length else b''
+        return HttpRequest(method, target, headers, body)
+
+    async def _reject(self, writer, status: int):
+        writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+
+    async def _dispatch(self, request):
+        handler = self._routes.get((request.method, request.path))
+        if handler is None:
+            known = any(path == request.path for _, path in self._routes)
+            return (405 if known else 404), "text/plain", b''
+        try:
+            return await handler(request)
+        except Exception as e:
+            logger.error(f"Ошибка обработки HTTP-запроса {request.method} {request.path}: {e}")
+            return 500, "text/plain", b''
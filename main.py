@@ -1,13 +1,40 @@
+import asyncio
 import logging
 import os
+import re
+import html
+import json
+import random
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from itertools import islice
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application, CommandHandler, CallbackQueryHandler, 
-    ContextTypes, MessageHandler, filters
+    ContextTypes, MessageHandler, TypeHandler, ApplicationHandlerStop, filters
 )
-from telegram.constants import ParseMode
-from collections import deque
-import json
+from telegram.constants import ParseMode, ChatType
+from telegram.error import TelegramError
+from queue_index import FenwickTree, PrefixIndex
+from student import Student
+from persistence import PersistenceWorker
+from queue_registry import QueueRegistry
+from board import LiveBoards
+from rate_limit import SendLimiter, KeyedBuckets
+from outbox import Outbox, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_BULK, dump_message
+from http_server import HttpServer
+from webhook import WebhookReceiver, serve_webhook
+from profiler import SamplingProfiler
+from state_store import StateStore
+from profiles import ProfileStore
+from edit_cache import EditCache, fingerprint
+from history import EventLog
+from service_time import ServiceTimes
+import metrics
+from storage import JsonFileStorage, SQLiteStorage, StaleVersion
 
 # Настройка логирования
 logging.basicConfig(
@@ -19,120 +46,889 @@ logger = logging.getLogger(__name__)
 # Файл для хранения очереди
 QUEUE_FILE = 'queue.json'
 
+# Хранилище очереди: json (queue.json с журналом) или sqlite
+QUEUE_STORAGE = os.getenv("QUEUE_STORAGE", "json")
+QUEUE_DB = os.getenv("QUEUE_DB", "queue.sqlite3")
+
+# Журнал изменений очереди: каждое изменение дописывается одной строкой,
+# а queue.json перезаписывается целиком только при периодическом сжатии
+QUEUE_JOURNAL = os.getenv("QUEUE_JOURNAL", "1") != "0"
+JOURNAL_COMPACT_EVERY = int(os.getenv("JOURNAL_COMPACT_EVERY", "1000"))
+
+# Максимальная задержка записи на диск: изменения за это окно записываются одной пачкой
+PERSIST_MAX_DELAY = float(os.getenv("PERSIST_MAX_DELAY", "0.2"))
+
+# Несколько независимых очередей: по группам и по лабораторным (/join lab3).
+# Основная очередь хранится в QUEUE_FILE, остальные — в отдельных файлах в QUEUES_DIR
+DEFAULT_QUEUE = "default"
+QUEUES_DIR = os.getenv("QUEUES_DIR", "queues")
+MAX_LOADED_QUEUES = int(os.getenv("MAX_LOADED_QUEUES", "100"))
+QUEUE_IDLE_TTL = float(os.getenv("QUEUE_IDLE_TTL", "600"))
+LAB_NAME_RE = re.compile(r'^[\w-]{1,32}$')
+CHAT_KEY_RE = re.compile(r'^chat_-?[0-9]+$')
+# callback_data кнопки — не больше 64 байт, а кириллица занимает по два байта на символ:
+# самая длинная кнопка "main_menu|lab_<название>|<страница>" должна уместиться
+CALLBACK_DATA_LIMIT = 64
+LAB_NAME_MAX_BYTES = CALLBACK_DATA_LIMIT - len("main_menu|lab_|99999")
+
+# Сколько студентов показывать на одной странице /queue (сообщение Telegram — до 4096 символов)
+QUEUE_PAGE_SIZE = int(os.getenv("QUEUE_PAGE_SIZE", "25"))
+MAX_NAME_LENGTH = 64
+MESSAGE_LIMIT = 4096
+
+# Живое табло (/board): закреплённое сообщение с очередью, обновляется не чаще раза в BOARD_INTERVAL секунд
+BOARDS_FILE = os.getenv("BOARDS_FILE", "boards.json")
+BOARD_INTERVAL = float(os.getenv("BOARD_INTERVAL", "3"))
+
+# После /next уведомляем первых NOTIFY_TOP_K студентов об их новой позиции.
+# Отправка ограничена лимитами Telegram: около 30 сообщений в секунду всего и 1 в секунду на чат
+NOTIFY_TOP_K = int(os.getenv("NOTIFY_TOP_K", "3"))
+SEND_RATE_GLOBAL = float(os.getenv("SEND_RATE_GLOBAL", "30"))
+SEND_RATE_PER_CHAT = float(os.getenv("SEND_RATE_PER_CHAT", "1"))
+SEND_BURST_PER_CHAT = float(os.getenv("SEND_BURST_PER_CHAT", "3"))
+
+# Сколько совпадений показывать в /find, /remove и /move
+FIND_LIMIT = int(os.getenv("FIND_LIMIT", "20"))
+
+# Наибольший размер файла со списком студентов для /import
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(1 << 20)))
+
+# История событий очередей: сегменты по HISTORY_SEGMENT_BYTES в каталоге HISTORY_DIR
+# (HISTORY_MAX_SEGMENTS — сколько хранить, 0 — все). Выгрузка /export — не больше EXPORT_MAX_BYTES
+HISTORY_DIR = os.getenv("HISTORY_DIR", "history")
+HISTORY_SEGMENT_BYTES = int(os.getenv("HISTORY_SEGMENT_BYTES", str(4 << 20)))
+HISTORY_MAX_SEGMENTS = int(os.getenv("HISTORY_MAX_SEGMENTS", "0"))
+EXPORT_MAX_BYTES = int(os.getenv("EXPORT_MAX_BYTES", str(20 << 20)))
+DATE_RE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+# Оценка ожидания по интервалам между /next: вес нового интервала в среднем, примерно сколько
+# последних сдач помнит статистика квантилей, перерыв (секунд), после которого интервал
+# не считается, и сколько интервалов нужно до первой оценки
+SERVICE_EWMA_ALPHA = float(os.getenv("SERVICE_EWMA_ALPHA", "0.2"))
+SERVICE_WINDOW = int(os.getenv("SERVICE_WINDOW", "200"))
+SERVICE_MAX_GAP = float(os.getenv("SERVICE_MAX_GAP", "1800"))
+SERVICE_MIN_SAMPLES = int(os.getenv("SERVICE_MIN_SAMPLES", "3"))
+
+# Очередь отправки: сколько сообщений отправляется параллельно и сколько может ждать.
+# При переполнении первыми отбрасываются массовые уведомления
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "8"))
+OUTBOX_MAX_SIZE = int(os.getenv("OUTBOX_MAX_SIZE", "1000"))
+
+# Перезапуск без потерь: при остановке незавершённые диалоги, неотправленные сообщения и список
+# загруженных очередей сохраняются в STATE_SNAPSHOT_FILE и восстанавливаются при запуске.
+# Досылать сообщения при остановке — не дольше SHUTDOWN_DRAIN_TIMEOUT секунд, остальные уйдут
+# после запуска; заранее загружать очереди — не дольше WARM_LOAD_BUDGET секунд
+STATE_SNAPSHOT_FILE = os.getenv("STATE_SNAPSHOT_FILE", "state_snapshot.json")
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "3"))
+WARM_LOAD_BUDGET = float(os.getenv("WARM_LOAD_BUDGET", "0.5"))
+
+# Режим получения обновлений: polling (по умолчанию) или webhook. В режиме webhook
+# Telegram присылает обновления на WEBHOOK_HOST:WEBHOOK_PORT/WEBHOOK_PATH с заголовком
+# секрета WEBHOOK_SECRET. Если задан WEBHOOK_URL (публичный адрес без пути), бот сам
+# регистрирует в Telegram WEBHOOK_URL + WEBHOOK_PATH
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", "8443")))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+
+# Метрики в формате Prometheus: http://METRICS_HOST:METRICS_PORT/metrics (порт 0 — не запускать)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# Профилирование по команде /profile: длительность окна по умолчанию и наибольшая (в секундах),
+# сколько функций показывать в отчёте
+PROFILE_SECONDS = int(os.getenv("PROFILE_SECONDS", "30"))
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "300"))
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", "30"))
+
+# Шаги диалогов (ввод фамилии после /join) ждут ответа не дольше CONVERSATION_TTL секунд;
+# одновременно хранится не больше MAX_CONVERSATIONS незавершённых диалогов
+CONVERSATION_TTL = float(os.getenv("CONVERSATION_TTL", "600"))
+MAX_CONVERSATIONS = int(os.getenv("MAX_CONVERSATIONS", "10000"))
+
+# Сохранённые фамилии студентов (отдельно от очередей): вернувшийся студент
+# встаёт в очередь сразу по /join. В памяти держится не больше PROFILE_CACHE_SIZE профилей
+PROFILES_DB = os.getenv("PROFILES_DB", "profiles.sqlite3")
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+
+# Сколько последних сообщений с кнопками помнить, чтобы не отправлять правки без изменений
+EDIT_CACHE_SIZE = int(os.getenv("EDIT_CACHE_SIZE", "10000"))
+
+# Защита от флуда: у каждого пользователя своё ведро токенов на изменения очереди
+# (/join, /leave, ввод фамилии, кнопки) и отдельное на просмотр. Лишние запросы
+# отбрасываются до обработчиков; предупреждение — не чаще раза в FLOOD_WARN_INTERVAL секунд
+# (0 — на каждый отброшенный запрос)
+FLOOD_MUTATE_RATE = float(os.getenv("FLOOD_MUTATE_RATE", "0.5"))
+FLOOD_MUTATE_BURST = float(os.getenv("FLOOD_MUTATE_BURST", "4"))
+FLOOD_VIEW_RATE = float(os.getenv("FLOOD_VIEW_RATE", "2"))
+FLOOD_VIEW_BURST = float(os.getenv("FLOOD_VIEW_BURST", "6"))
+FLOOD_WARN_INTERVAL = float(os.getenv("FLOOD_WARN_INTERVAL", "10"))
+FLOOD_MAX_USERS = int(os.getenv("FLOOD_MAX_USERS", "10000"))
+
+# Сколько обновлений обрабатывается одновременно
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
+
 # ID администратора (твой Telegram ID)
 ADMIN_ID = 797023520  # ЗАМЕНИ ЭТОТ ID НА СВОЙ
 
-# Словарь для временного хранения фамилий
-pending_surnames = {}
+# Незавершённые диалоги: user_id -> шаг и его данные.
+# Шаг "surname" — ждём фамилию, данные — очередь, в которую встаёт студент
+conversations = StateStore(ttl=CONVERSATION_TTL, max_size=MAX_CONVERSATIONS)
+
+# Профили студентов; база открывается при первом обращении
+profiles = ProfileStore(PROFILES_DB, max_cached=PROFILE_CACHE_SIZE)
+
+# Кто и когда вставал в очередь, выходил и сдавал
+history = EventLog(HISTORY_DIR, segment_bytes=HISTORY_SEGMENT_BYTES, max_segments=HISTORY_MAX_SEGMENTS)
+
+# Статистика времени на одного студента по очередям; выгружается вместе с очередью
+service_times = {}
+
+def name_fields(student: Student):
+    """Поля записи, по которым ищет преподаватель (те же, что в отображаемом имени)"""
+    return student.surname, student.first_name, student.username
 
 class StudentQueue:
-    def __init__(self):
-        self.queue = deque()
+    def __init__(self, storage, writer=None):
+        self.storage = storage
+        # Фоновый писатель; без него изменения записываются сразу
+        self.writer = writer
+        # Записи хранятся по порядковым номерам: порядок словаря совпадает с порядком очереди,
+        # а дерево Фенвика по номерам даёт позицию записи за O(log n)
+        self._students = {}
+        self._seq_by_user = {}
+        self._tree = FenwickTree()
+        # Поиск по началу фамилии, имени и username — для записей без user_id.
+        # Строится при первом поиске, чтобы не замедлять загрузку большой очереди
+        self._names = None
+        self._next_seq = 1
+        self._pending = []
+        # Свои изменения, отклонённые хранилищем: их опередил другой экземпляр бота
+        self._rejected = []
+        # Записи открытой транзакции (None — транзакции нет) и флаг "следующая запись — снимок"
+        self._transaction = None
+        self._snapshot_due = False
+        # В загруженном снимке были записи старого формата без фамилии
+        self._legacy_records = False
+        # Растёт при каждом изменении очереди; по нему сбрасываются кэши отображения
+        self.version = 0
+        # Функции listener(queue, record), вызываемые после каждого изменения
+        self.listeners = []
         self.load_queue()
         self.migrate_old_data()
 
+    def __len__(self):
+        return len(self._students)
+
+    def view(self):
+        """Записи очереди по порядку без копирования (живое представление только для чтения)"""
+        return self._students.values()
+
+    def _rebuild(self, students):
+        """Перестроение индексов по списку студентов с перенумерацией записей"""
+        self._students = {}
+        self._seq_by_user = {}
+        for seq, student in enumerate(students, 1):
+            self._students[seq] = student
+            user_id = student.user_id
+            if user_id is not None:
+                self._seq_by_user.setdefault(user_id, seq)
+        self._names = None
+        self._tree = FenwickTree.from_ones(len(students), max(2 * len(students), 64))
+        self._next_seq = len(students) + 1
+
+    def _unlink(self, seq: int):
+        """Удаление записи с порядковым номером seq из индексов"""
+        student = self._students.pop(seq)
+        self._tree.add(seq, -1)
+        if self._names is not None:
+            self._names.remove(seq, name_fields(student))
+        user_id = student.user_id
+        if user_id is not None and self._seq_by_user.get(user_id) == seq:
+            del self._seq_by_user[user_id]
+        return student
+
+    def _append(self, student):
+        """Добавление записи в конец очереди без сохранения"""
+        # Номера записей только растут, поэтому при нехватке места перенумеровываем очередь
+        if self._next_seq > self._tree.size:
+            self._rebuild(list(self._students.values()))
+
+        seq = self._next_seq
+        self._next_seq += 1
+        self._students[seq] = student
+        user_id = student.user_id
+        if user_id is not None:
+            self._seq_by_user[user_id] = seq
+        self._tree.add(seq, 1)
+        if self._names is not None:
+            self._names.add(seq, name_fields(student))
+
+    def _apply(self, record):
+        """Применение сохранённой записи об изменении к очереди"""
+        if record['op'] == 'add':
+            self._append(Student.from_dict(record['student']))
+        elif record['op'] == 'remove':
+            self._unlink(self._tree.find_kth(record['index'] + 1))
+        elif record['op'] == 'move':
+            students = list(self._students.values())
+            students.insert(record['to'], students.pop(record['index']))
+            self._rebuild(students)
+
     def add_student(self, user_id: int, username: str, first_name: str, surname: str = ""):
         """Добавление студента в очередь"""
-        student = {
-            'user_id': user_id,
-            'username': username,
-            'first_name': first_name,
-            'surname': surname
-        }
+        return self._add(Student(user_id, username, first_name, surname))
 
+    def _add(self, student: Student):
         # Проверяем, нет ли уже студента в очереди
-        for existing_student in self.queue:
-            if existing_student['user_id'] == user_id:
-                return False
+        if student.user_id is not None and student.user_id in self._seq_by_user:
+            return False
 
-        self.queue.append(student)
-        self.save_queue()
+        self._append(student)
+        self._commit({'op': 'add', 'student': student.to_dict()})
         return True
 
     def remove_student(self, user_id: int):
-        """Удаление студента из очереди"""
-        for i, student in enumerate(self.queue):
-            if student['user_id'] == user_id:
-                del self.queue[i]
-                self.save_queue()
-                return True
-        return False
+        """Удаление студента из очереди; удалённая запись или None"""
+        seq = self._seq_by_user.get(user_id)
+        if seq is None:
+            return None
+        index = self._tree.prefix_sum(seq) - 1
+        removed = self._unlink(seq)
+        self._commit({'op': 'remove', 'index': index, 'user_id': user_id})
+        return removed
 
     def remove_first(self):
         """Удаление первого студента из очереди"""
-        if self.queue:
-            removed = self.queue.popleft()
-            self.save_queue()
+        if self._students:
+            removed = self._unlink(self._tree.find_kth(1))
+            self._commit({'op': 'remove', 'index': 0, 'user_id': removed.user_id})
             return removed
         return None
 
+    def remove_at(self, position: int, expected=None):
+        """Удаление студента с позиции position; expected — запись, которая должна там стоять"""
+        if not 1 <= position <= len(self._students):
+            return None
+        seq = self._tree.find_kth(position)
+        if expected is not None and self._students[seq] is not expected:
+            return None
+        removed = self._unlink(seq)
+        self._commit({'op': 'remove', 'index': position - 1, 'user_id': removed.user_id})
+        return removed
+
+    def move(self, position: int, new_position: int, expected=None):
+        """Перемещение студента с позиции position на new_position (очередь перенумеровывается за O(n))"""
+        count = len(self._students)
+        if not (1 <= position <= count and 1 <= new_position <= count):
+            return None
+        students = list(self._students.values())
+        student = students[position - 1]
+        if expected is not None and student is not expected:
+            return None
+        if position != new_position:
+            students.insert(new_position - 1, students.pop(position - 1))
+            self._rebuild(students)
+            self._commit({'op': 'move', 'index': position - 1, 'to': new_position - 1,
+                          'user_id': student.user_id})
+        return student
+
+    def find(self, query: str, limit: int = None):
+        """Студенты, у которых фамилия, имя или username начинаются со слов query: [(позиция, запись)]"""
+        if self._names is None:
+            self._names = PrefixIndex()
+            self._names.build((seq, name_fields(student)) for seq, student in self._students.items())
+        seqs = self._names.search(query)
+        if limit is not None:
+            seqs = seqs[:limit]
+        return [(self._tree.prefix_sum(seq), self._students[seq]) for seq in seqs]
+
+    def student_at(self, position: int):
+        """Запись студента на позиции position или None"""
+        if not 1 <= position <= len(self._students):
+            return None
+        return self._students[self._tree.find_kth(position)]
+
+    @contextmanager
+    def transaction(self):
+        """Пакет изменений: применяется в памяти и сохраняется одной записью полного снимка.
+
+        Слушатели получают одну запись {'op': 'batch', 'records': [...]}. Если блок
+        завершился исключением, очередь возвращается к состоянию до транзакции
+        и ничего не сохраняется. Вложенная транзакция становится частью внешней.
+        """
+        if self._transaction is not None:
+            yield self
+            return
+
+        saved = list(self._students.values())
+        self._transaction = []
+        try:
+            yield self
+        except BaseException:
+            records, self._transaction = self._transaction, None
+            if records:
+                self._rebuild(saved)
+            raise
+        records, self._transaction = self._transaction, None
+        if records:
+            # Снимок записывается атомарно (переименование файла или одна транзакция SQLite),
+            # поэтому сбой во время записи не оставит пакет применённым наполовину
+            self._snapshot_due = True
+            self._commit({'op': 'batch', 'records': records})
+
+    def import_students(self, students):
+        """Добавление записей Student одной транзакцией; список добавленных"""
+        with self.transaction():
+            return [student for student in students if self._add(student)]
+
+    def clear(self):
+        """Удаление всех студентов одной транзакцией; список удалённых"""
+        with self.transaction():
+            return [self.remove_first() for _ in range(len(self._students))]
+
+    def shuffle(self):
+        """Случайный порядок очереди одной транзакцией"""
+        if not self._students:
+            # Перемешивать нечего: без записи и новой версии хранилища
+            return 0
+        students = list(self._students.values())
+        random.shuffle(students)
+        with self.transaction():
+            self._rebuild(students)
+            self._commit({'op': 'reorder'})
+        return len(students)
+
     def get_queue(self):
-        """Получение текущей очереди"""
-        return list(self.queue)
+        """Копия текущей очереди; для чтения без копирования — view()"""
+        return list(self._students.values())
+
+    def get_page(self, start: int, count: int):
+        """Студенты с позиции start + 1 (не больше count)"""
+        return list(islice(self._students.values(), start, start + count))
+
+    def get_student(self, user_id: int):
+        """Получение записи студента по его ID"""
+        seq = self._seq_by_user.get(user_id)
+        if seq is None:
+            return None
+        return self._students[seq]
 
     def get_position(self, user_id: int):
         """Получение позиции студента в очереди"""
-        for i, student in enumerate(self.queue):
-            if student['user_id'] == user_id:
-                return i + 1
-        return None
+        seq = self._seq_by_user.get(user_id)
+        if seq is None:
+            return None
+        return self._tree.prefix_sum(seq)
+
+    def _commit(self, record):
+        """Учёт изменения очереди"""
+        if self._transaction is not None:
+            self._transaction.append(record)
+            return
+        self.version += 1
+        self._persist(record)
+        for listener in self.listeners:
+            listener(self, record)
+
+    def _persist(self, record):
+        """Сохранение одного изменения: сразу или через фоновый писатель"""
+        self._pending.append(record)
+        if self.writer is not None:
+            self.writer.schedule(self)
+        else:
+            self.write_pending()
 
-    def save_queue(self):
-        """Сохранение очереди в файл"""
+    def take_pending(self, compact: bool = False):
+        """Забрать накопленные изменения; вызывается в потоке event loop.
+
+        Возвращает записи для хранилища и, если хранилищу нужен полный снимок, сам снимок.
+        """
+        records, self._pending = self._pending, []
+        compact, self._snapshot_due = compact or self._snapshot_due, False
+        if self.storage.prepare(len(records), len(self), force=compact):
+            return records, self.get_queue()
+        return records, None
+
+    def write_batch(self, records, snapshot):
+        """Запись пачки изменений в хранилище; может выполняться в отдельном потоке"""
+        # Записи неизменяемы, поэтому снимок переводится в формат queue.json уже в потоке записи
+        self.storage.write(records, None if snapshot is None else [student.to_dict() for student in snapshot])
+
+    def write_pending(self, compact: bool = False):
+        """Синхронная запись накопленных изменений (compact — полным снимком)"""
+        records, snapshot = self.take_pending(compact)
         try:
-            with open(QUEUE_FILE, 'w', encoding='utf-8') as f:
-                json.dump(list(self.queue), f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            logger.error(f"Ошибка сохранения очереди: {e}")
+            self.write_batch(records, snapshot)
+        except StaleVersion:
+            self.reject(records)
 
-    def load_queue(self):
-        """Загрузка очереди из файла"""
+    def reject(self, records):
+        """Пачка не записана: хранилище успел изменить другой экземпляр бота"""
+        self._rejected.extend(records)
+        self.sync()
+
+    def sync(self):
+        """Подтягивание изменений других экземпляров бота; вызывается перед каждым изменением очереди.
+
+        Если в памяти нет незаписанных изменений, дочитываются только новые
+        записи хранилища. Иначе очередь загружается заново, а свои незаписанные
+        изменения применяются поверх неё ещё раз — вместо того чтобы затереть чужие.
+        """
+        if self._transaction is not None:
+            return
+        if not self._rejected and self.storage.current_version() <= self.storage.version:
+            return
+        # Пока пачки этой очереди пишутся, их судьба неизвестна: повторим после записи
+        if self.writer is not None and self.writer.is_writing(self):
+            return
+
+        local, self._rejected, self._pending = self._rejected + self._pending, [], []
+        records = None if local else self.storage.load_changes()
         try:
-            if os.path.exists(QUEUE_FILE):
-                with open(QUEUE_FILE, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.queue = deque(data)
+            for record in records or ():
+                self._apply(record)
+        except (KeyError, TypeError):
+            records = None
+        if records is None:
+            self.load_queue()
+        elif not records:
+            return
+        logger.info(f"Очередь изменена другим экземпляром бота: загружено, своих изменений повторено {len(local)}")
+
+        self.version += 1
+        for listener in self.listeners:
+            listener(self, {'op': 'reload'})
+        for record in local:
+            self._replay(record)
+
+    def _replay(self, record):
+        """Повторное применение своего изменения поверх чужих: студенты ищутся по user_id, а не по позиции"""
+        user_id = record.get('user_id')
+        if record['op'] == 'add':
+            self._add(Student.from_dict(record['student']))
+        elif record['op'] == 'remove':
+            if user_id is not None:
+                self.remove_student(user_id)
             else:
-                self.queue = deque()
+                self.remove_at(record['index'] + 1)
+        elif record['op'] == 'move':
+            position = self.get_position(user_id) if user_id is not None else record['index'] + 1
+            if position is not None:
+                self.move(position, min(record['to'] + 1, len(self)))
+        elif record['op'] == 'batch':
+            with self.transaction():
+                for item in record['records']:
+                    self._replay(item)
+        elif record['op'] == 'reorder':
+            self.shuffle()
+
+    def save_queue(self):
+        """Сохранение полного снимка очереди"""
+        self.write_pending(compact=True)
+
+    def load_queue(self):
+        """Загрузка очереди из хранилища"""
+        try:
+            students, records = self.storage.load()
         except Exception as e:
             logger.error(f"Ошибка загрузки очереди: {e}")
-            self.queue = deque()
+            students, records = [], []
+
+        self._legacy_records = any('surname' not in student for student in students)
+        self._rebuild([Student.from_dict(student) for student in students])
+        for record in records:
+            try:
+                self._apply(record)
+            except (KeyError, TypeError):
+                logger.warning("Пропущена запись журнала, не подходящая к очереди")
+                self.storage.invalidate()
+                break
 
     def migrate_old_data(self):
         """Миграция старых данных - добавление поля surname если его нет"""
-        migrated = False
-        for student in self.queue:
-            if 'surname' not in student:
-                student['surname'] = ""
-                migrated = True
-        
-        if migrated:
+        # Записи без фамилии получают пустую при загрузке; остаётся сохранить новый формат
+        if self._legacy_records:
+            self._legacy_records = False
             self.save_queue()
             logger.info("Мигрированы старые данные: добавлено поле surname")
 
-# Создаем экземпляр очереди
-student_queue = StudentQueue()
+# Создаем хранилище для очереди с ключом key
+def make_storage(key: str = DEFAULT_QUEUE):
+    if key == DEFAULT_QUEUE:
+        json_file, db_file = QUEUE_FILE, QUEUE_DB
+    else:
+        os.makedirs(QUEUES_DIR, exist_ok=True)
+        json_file = os.path.join(QUEUES_DIR, f"{key}.json")
+        db_file = os.path.join(QUEUES_DIR, f"{key}.sqlite3")
+
+    if QUEUE_STORAGE == "sqlite":
+        return SQLiteStorage(db_file, import_file=json_file)
+    return JsonFileStorage(json_file, journal=QUEUE_JOURNAL, compact_every=JOURNAL_COMPACT_EVERY)
+
+def open_queue(key: str):
+    queue = StudentQueue(make_storage(key), writer=persistence)
+    queue.listeners.append(lambda queue, record: boards.changed(key))
+    return queue
+
+persistence = PersistenceWorker(PERSIST_MAX_DELAY)
+# Очереди загружаются по требованию; все изменения каждой идут через её актора,
+# чтобы обработчики могли работать параллельно
+queues = QueueRegistry(open_queue, persistence, max_loaded=MAX_LOADED_QUEUES, idle_ttl=QUEUE_IDLE_TTL,
+                       on_evict=lambda key: service_times.pop(key, None))
+
+def valid_lab_name(name: str) -> bool:
+    """Название лабораторной, ключ очереди которой поместится в callback_data кнопок"""
+    return LAB_NAME_RE.match(name) is not None and len(name.lower().encode('utf-8')) <= LAB_NAME_MAX_BYTES
+
+def valid_queue_key(key: str) -> bool:
+    """Ключ очереди из callback_data: его присылает клиент, а по ключу строится имя файла очереди"""
+    if key == DEFAULT_QUEUE:
+        return True
+    if key.startswith("lab_"):
+        return valid_lab_name(key[4:])
+    return CHAT_KEY_RE.match(key) is not None
+
+# Определение очереди, к которой относится команда
+def resolve_queue_key(update: Update, context: ContextTypes.DEFAULT_TYPE, lab: str = None) -> str:
+    """Явно указанная лабораторная, иначе очередь группы, иначе последняя выбранная"""
+    if lab and valid_lab_name(lab):
+        key = DEFAULT_QUEUE if lab.lower() == DEFAULT_QUEUE else f"lab_{lab.lower()}"
+        context.user_data['queue_key'] = key
+        return key
+
+    chat = update.effective_chat
+    if chat and chat.type != ChatType.PRIVATE:
+        return f"chat_{chat.id}"
+
+    return context.user_data.get('queue_key', DEFAULT_QUEUE)
+
+def command_queue_key(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
+    """Очередь для команды вида /join [лабораторная]"""
+    return resolve_queue_key(update, context, context.args[0] if context.args else None)
+
+def cb(action: str, key: str) -> str:
+    """callback_data кнопки с привязкой к очереди"""
+    return f"{action}|{key}"
+
+def queue_title(key: str) -> str:
+    """Подпись очереди для сообщений"""
+    if key.startswith("lab_"):
+        return f" ({key[4:]})"
+    return ""
 
 # Функция проверки прав администратора
 def is_admin(user_id: int) -> bool:
     """Проверяет, является ли пользователь администратором"""
     return user_id == ADMIN_ID
 
-# Вспомогательная функция для получения отображаемого имени
-def get_display_name(student):
-    """Получение отображаемого имени студента"""
-    surname = student.get('surname', '')
-    first_name = student.get('first_name', '')
-    username = student.get('username', '')
-    
-    if surname:
-        return f"{surname} {first_name}"
+# Отрисовка страницы очереди — общая для /queue и кнопки "Показать очередь"
+def render_queue_page(shard, page: int, admin: bool):
+    """Текст и клавиатура страницы очереди; результат кэшируется до изменения очереди"""
+    queue = shard.queue
+    if shard.views_version != queue.version:
+        shard.views.clear()
+        shard.views_version = queue.version
+
+    total = len(queue)
+    pages = max(1, (total + QUEUE_PAGE_SIZE - 1) // QUEUE_PAGE_SIZE)
+    page = min(max(page, 1), pages)
+    cached = shard.views.get(('queue', page, admin))
+    if cached:
+        return cached
+
+    key = shard.key
+    if not total:
+        queue_text = "📝 <strong>Очередь пуста!</strong>\n\nИспользуй /join чтобы встать в очередь"
+
+        keyboard = [
+            [InlineKeyboardButton("📝 Встать в очередь", callback_data=cb("join", key))],
+            [InlineKeyboardButton("🏠 Главное меню", callback_data=cb("main_menu", key))]
+        ]
     else:
-        return f"{first_name} ({username})"
+        start = (page - 1) * QUEUE_PAGE_SIZE
+        header = f"📋 <strong>Текущая очередь{queue_title(key)}:</strong>\n"
+        footer = f"\n👥 <strong>Всего в очереди:</strong> {total}"
+        if pages > 1:
+            footer += f"\n📄 Страница {page} из {pages}"
+
+        lines = [header]
+        budget = MESSAGE_LIMIT - len(header) - len(footer) - 2
+        for i, student in enumerate(queue.get_page(start, QUEUE_PAGE_SIZE), start + 1):
+            display_name = html.escape(student.display_name[:MAX_NAME_LENGTH])
+            line = f"<strong>{i}.</strong> {display_name}"
+            # Даже страница из длинных имён не должна превышать лимит сообщения
+            budget -= len(line) + 1
+            if budget < 0:
+                lines.append("…")
+                break
+            lines.append(line)
+        lines.append(footer)
+        queue_text = "\n".join(lines)
+
+        keyboard = []
+        if pages > 1:
+            navigation = []
+            if page > 1:
+                navigation.append(InlineKeyboardButton("◀️ Назад", callback_data=f"{cb('queue', key)}|{page - 1}"))
+            if page < pages:
+                navigation.append(InlineKeyboardButton("Вперёд ▶️", callback_data=f"{cb('queue', key)}|{page + 1}"))
+            keyboard.append(navigation)
+
+        keyboard.append([InlineKeyboardButton("📝 Встать в очередь", callback_data=cb("join", key))])
+        keyboard.append([InlineKeyboardButton("🔍 Моя позиция", callback_data=cb("position", key))])
+
+        # Только для администратора добавляем кнопку управления
+        if admin:
+            keyboard.append([InlineKeyboardButton("⚙️ Панель управления", callback_data=cb("admin", key))])
+
+        keyboard.append([InlineKeyboardButton("🏠 Главное меню", callback_data=cb("main_menu", key))])
+
+    rendered = (queue_text, InlineKeyboardMarkup(keyboard))
+    shard.views[('queue', page, admin)] = rendered
+    return rendered
+
+send_limiter = SendLimiter(SEND_RATE_GLOBAL, SEND_RATE_PER_CHAT, SEND_BURST_PER_CHAT)
+# Все сообщения бота уходят через общую очередь отправки: обработчики не ждут сеть,
+# ответы преподавателю идут раньше остальных, а flood control Telegram переживается повтором
+outbox = Outbox(send_limiter, workers=OUTBOX_WORKERS, max_size=OUTBOX_MAX_SIZE)
+
+def reply_priority(update: Update) -> int:
+    """Ответы преподавателю отправляются первыми"""
+    return PRIORITY_HIGH if is_admin(update.effective_user.id) else PRIORITY_NORMAL
+
+# Отпечатки последнего вида сообщений с кнопками
+edit_cache = EditCache(EDIT_CACHE_SIZE)
+
+def reply(update: Update, text: str, **kwargs):
+    """Ответ на сообщение пользователя через очередь отправки"""
+    future = outbox.reply(update.message, text, reply_priority(update), **kwargs)
+    if kwargs.get('reply_markup') is not None:
+        # Запоминаем вид сообщения с кнопками: первое же "Обновить" без изменений не уйдёт в Telegram
+        digest = fingerprint(text, kwargs['reply_markup'])
+
+        def remember(future):
+            if not future.cancelled() and future.exception() is None:
+                edit_cache.remember(future.result().chat_id, future.result().message_id, digest)
+
+        future.add_done_callback(remember)
+    return future
+
+def edit(update: Update, text: str, **kwargs):
+    """Замена сообщения с нажатой кнопкой через очередь отправки"""
+    message = update.callback_query.message
+    future = outbox.edit(message, text, reply_priority(update), **kwargs)
+
+    def forget(future):
+        # Правка не удалась — вид сообщения неизвестен
+        if future.cancelled() or future.exception() is not None:
+            edit_cache.forget(message.chat_id, message.message_id)
+
+    future.add_done_callback(forget)
+    return future
+
+# Уведомления студентам в начале очереди после её продвижения
+def notify_front(shard):
+    """Сообщить первым NOTIFY_TOP_K студентам их новую позицию"""
+    for position, student in enumerate(shard.queue.get_page(0, NOTIFY_TOP_K), 1):
+        # Студенты из списка без user_id уведомления получить не могут
+        if not student.user_id:
+            continue
+        if position == 1:
+            text = "🎯 <strong>Ты следующий в очереди! Подготовься к сдаче.</strong>"
+        else:
+            text = f"⏳ <strong>Очередь продвинулась!</strong>\nТвоя позиция: <strong>{position}</strong>"
+        outbox.send(student.user_id, text, PRIORITY_BULK, parse_mode=ParseMode.HTML)
+
+def render_board(key: str):
+    """Табло — первая страница очереди, как у /queue, но без кнопок.
+
+    Табло одно на весь чат: нажатие кнопки заменило бы его видом одного студента.
+    """
+    text, _ = render_queue_page(queues.get(key), 1, False)
+    return text, None
+
+boards = LiveBoards(render_board, outbox, BOARDS_FILE, BOARD_INTERVAL)
+
+# Метрики: задержки обработчиков, события очередей и состояние бота.
+# На горячем пути только счётчики и гистограммы, остальное считается при опросе
+HANDLER_SECONDS = metrics.histogram('queue_bot_handler_seconds', "Время обработки обновления", ('handler',))
+CALLBACK_SECONDS = metrics.histogram('queue_bot_callback_seconds', "Время обработки нажатия кнопки", ('action',))
+QUEUE_EVENTS = metrics.counter('queue_bot_queue_events_total', "Записи в очередь, выходы, вызовы следующего и правки преподавателя", ('event',))
+metrics.gauge('queue_bot_queue_length', "Длина загруженных очередей", ('queue',),
+              collect=lambda: {(shard.key,): len(shard.queue) for shard in queues.loaded()})
+metrics.gauge('queue_bot_pending_surnames', "Пользователи, от которых бот ждёт фамилию",
+              collect=lambda: {(): conversations.count("surname")})
+metrics.gauge('queue_bot_outbox_size', "Сообщения, ожидающие отправки", collect=lambda: {(): len(outbox)})
+metrics.counter('queue_bot_outbox_messages_total', "Сообщения очереди отправки по результату", ('result',),
+                collect=lambda: {(result,): count for result, count in outbox.stats.items()})
+metrics.counter('queue_bot_api_errors_total', "Ошибки запросов к Bot API по типу", ('error',),
+                collect=lambda: {(error,): count for error, count in outbox.errors.items()})
+
+def queue_event(key: str, event: str, *students):
+    """Учёт события очереди key: счётчик метрик и строки истории по каждому студенту"""
+    QUEUE_EVENTS.inc(max(len(students), 1), event=event)
+    if not students:
+        history.record(key, event)
+    for student in students:
+        history.record(key, event, student)
+    if event == "next":
+        service_stats(key).next_called(time.time(), len(queues.get(key).queue))
+    elif event in ("clear", "shuffle"):
+        service_stats(key).pause()
+
+def service_stats(key: str) -> ServiceTimes:
+    """Статистика времени сдачи очереди key"""
+    stats = service_times.get(key)
+    if stats is None:
+        stats = service_times[key] = ServiceTimes(SERVICE_EWMA_ALPHA, SERVICE_WINDOW, SERVICE_MAX_GAP, SERVICE_MIN_SAMPLES)
+    return stats
+
+def format_duration(seconds: float) -> str:
+    """Длительность для сообщений: 3 мин, 1 ч 20 мин"""
+    minutes = round(seconds / 60)
+    if minutes < 1:
+        return "меньше минуты"
+    if minutes < 60:
+        return f"{minutes} мин"
+    return f"{minutes // 60} ч {minutes % 60} мин" if minutes % 60 else f"{minutes // 60} ч"
+
+def service_text(key: str, total: int) -> str:
+    """Строки панели преподавателя: время на студента и когда очередь закончится"""
+    stats = service_stats(key)
+    if not stats.ready():
+        return "⏱ Время на студента: <em>появится после нескольких вызовов /next</em>\n"
+    text = (f"⏱ Время на студента: <strong>{format_duration(stats.mean)}</strong> "
+            f"(обычно от {format_duration(stats.sketch.quantile(0.1))} до {format_duration(stats.sketch.quantile(0.9))})\n")
+    if total:
+        expected, low, high = stats.estimate(total, time.time())
+        text += (f"⌛ Очередь закончится примерно через <strong>{format_duration(expected)}</strong> "
+                 f"(от {format_duration(low)} до {format_duration(high)})\n")
+    return text
+
+def wait_text(key: str, position: int) -> str:
+    """Строка с оценкой ожидания для студента на позиции position (пустая, если данных мало)"""
+    if position == 1:
+        return "⏳ <strong>Ожидание:</strong> твоя очередь подошла\n"
+    estimate = service_stats(key).estimate(position - 1, time.time())
+    if estimate is None:
+        return ""
+    expected, low, high = estimate
+    return (f"⏳ <strong>Примерное ожидание:</strong> {format_duration(expected)} "
+            f"(от {format_duration(low)} до {format_duration(high)})\n")
+
+CALLBACK_ACTIONS = {"join", "leave", "queue", "position", "next", "admin", "profile", "help", "main_menu", "clear"}
+
+def instrumented(callback):
+    """Обработчик с замером времени; для кнопок время учитывается ещё и по действию"""
+    name = callback.__name__
+
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            HANDLER_SECONDS.observe(elapsed, handler=name)
+            if update.callback_query is not None:
+                action = (update.callback_query.data or "").partition('|')[0]
+                # Метки только из известного набора: callback_data присылает клиент
+                CALLBACK_SECONDS.observe(elapsed, action=action if action in CALLBACK_ACTIONS else "other")
+
+    return wrapper
+
+async def serve_metrics(request):
+    return 200, "text/plain; version=0.0.4; charset=utf-8", metrics.REGISTRY.render().encode('utf-8')
+
+FLOOD_DROPPED = metrics.counter('queue_bot_flood_dropped_total', "Запросы, отброшенные защитой от флуда", ('action_class',))
+
+metrics_server = HttpServer(METRICS_HOST, METRICS_PORT)
+metrics_server.route("GET", "/metrics", serve_metrics)
+
+# Профилировщик включается администратором на ограниченное время; в остальное время его нет
+profiler = SamplingProfiler()
+# Задача, ждущая конца окна профилирования. Не через application.create_task:
+# Application.stop() ждёт такие задачи, и остановка бота затянулась бы до конца окна
+profile_task = None
+
+async def finish_profile(chat_id: int, seconds: int, flame: bool):
+    """Конец окна профилирования: отчёт (и стеки для flame graph) документами администратору"""
+    await asyncio.sleep(seconds)
+    result = profiler.stop()
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    outbox.submit(
+        chat_id, 'send_document', PRIORITY_HIGH, chat_id=chat_id,
+        document=result.report(PROFILE_TOP_N).encode('utf-8'), filename=f"profile-{stamp}.txt",
+        caption=f"🔬 Профиль за {seconds} с"
+    )
+    if flame:
+        outbox.submit(
+            chat_id, 'send_document', PRIORITY_HIGH, chat_id=chat_id,
+            document=result.collapsed().encode('utf-8'), filename=f"profile-{stamp}.collapsed",
+            caption="🔥 Стеки для flame graph (flamegraph.pl, speedscope)"
+        )
+    logger.info(f"Профилирование завершено: {result.samples} сэмплов")
+
+def start_profile(chat_id: int, seconds: int, flame: bool = False) -> str:
+    """Запуск окна профилирования; возвращает текст ответа администратору"""
+    global profile_task
+    if profiler.running:
+        return "❌ <strong>Профилирование уже идёт!</strong>"
+    profiler.start()
+    profile_task = asyncio.create_task(finish_profile(chat_id, seconds, flame))
+    logger.info(f"Профилирование запущено на {seconds} с")
+    return f"🔬 <strong>Профилирование запущено на {seconds} с</strong>\nОтчёт придёт документом в этот чат"
+
+# Защита от флуда: ведра по пользователю для каждого класса действий.
+# Число вёдер ограничено FLOOD_MAX_USERS, давно не писавшие пользователи вытесняются
+flood_buckets = {
+    'mutate': KeyedBuckets(FLOOD_MUTATE_RATE, FLOOD_MUTATE_BURST, max_keys=FLOOD_MAX_USERS),
+    'view': KeyedBuckets(FLOOD_VIEW_RATE, FLOOD_VIEW_BURST, max_keys=FLOOD_MAX_USERS),
+}
+flood_warnings = KeyedBuckets(1 / FLOOD_WARN_INTERVAL, 1, max_keys=FLOOD_MAX_USERS) if FLOOD_WARN_INTERVAL > 0 else None
+FLOOD_TEXT = "⏳ Слишком много запросов, подожди несколько секунд"
+MUTATING_COMMANDS = {"join", "leave", "next", "surname", "remove", "move", "import", "clear", "shuffle"}
+MUTATING_ACTIONS = {"join", "leave", "next", "clear"}
+
+def action_class(update: Update):
+    """Класс действия для защиты от флуда: mutate, view или None (не ограничивается)"""
+    if update.callback_query is not None:
+        action = (update.callback_query.data or "").partition('|')[0]
+        return 'mutate' if action in MUTATING_ACTIONS else 'view'
+    message = update.message
+    if message is None or not message.text:
+        return None
+    if message.text.startswith('/'):
+        command = message.text[1:].split(maxsplit=1)[0].partition('@')[0].lower() if len(message.text) > 1 else ""
+        return 'mutate' if command in MUTATING_COMMANDS else 'view'
+    # Обычный текст меняет очередь, только если это ответ в диалоге (ввод фамилии, названия, списка)
+    user = update.effective_user
+    return 'mutate' if user is not None and conversations.state(user.id) else None
+
+async def flood_guard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отбрасывает запросы сверх лимита до того, как они дойдут до очереди и сети"""
+    user = update.effective_user
+    if user is None or is_admin(user.id):
+        return
+    action = action_class(update)
+    if action is None or flood_buckets[action].get(user.id).try_acquire():
+        return
+
+    FLOOD_DROPPED.inc(action_class=action)
+    # Одно предупреждение на серию: остальные лишние запросы не стоят ни одного обращения к Telegram
+    if flood_warnings is None or flood_warnings.get(user.id).try_acquire():
+        if update.callback_query is not None:
+            await update.callback_query.answer(FLOOD_TEXT)
+        else:
+            reply(update, FLOOD_TEXT)
+    raise ApplicationHandlerStop
 
 # Команда /start
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
+    key = command_queue_key(update, context)
     welcome_text = f"""
 Привет, {user.first_name}! 👋
 
@@ -144,6 +940,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /leave - Покинуть очередь  
 /queue - Показать текущую очередь
 /position - Узнать свою позицию
+/surname - Сменить сохранённую фамилию
 /help - Помощь по использованию
     """
 
@@ -158,40 +955,41 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
 
     keyboard = [
-        [InlineKeyboardButton("📝 Встать в очередь", callback_data="join")],
-        [InlineKeyboardButton("❌ Покинуть очередь", callback_data="leave")],
-        [InlineKeyboardButton("📋 Показать очередь", callback_data="queue")],
-        [InlineKeyboardButton("🔍 Моя позиция", callback_data="position")],
+        [InlineKeyboardButton("📝 Встать в очередь", callback_data=cb("join", key))],
+        [InlineKeyboardButton("❌ Покинуть очередь", callback_data=cb("leave", key))],
+        [InlineKeyboardButton("📋 Показать очередь", callback_data=cb("queue", key))],
+        [InlineKeyboardButton("🔍 Моя позиция", callback_data=cb("position", key))],
     ]
 
     # Только для администратора показываем кнопку "Следующий студент"
     if is_admin(user.id):
-        keyboard.append([InlineKeyboardButton("✅ Следующий студент", callback_data="next")])
-        keyboard.append([InlineKeyboardButton("⚙️ Панель управления", callback_data="admin")])
+        keyboard.append([InlineKeyboardButton("✅ Следующий студент", callback_data=cb("next", key))])
+        keyboard.append([InlineKeyboardButton("⚙️ Панель управления", callback_data=cb("admin", key))])
 
-    keyboard.append([InlineKeyboardButton("ℹ️ Помощь", callback_data="help")])
+    keyboard.append([InlineKeyboardButton("ℹ️ Помощь", callback_data=cb("help", key))])
 
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    await update.message.reply_text(welcome_text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+    reply(update, welcome_text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
 
 # Команда /admin - только для администратора
 async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     
     if not is_admin(user.id):
-        await update.message.reply_text("❌ <strong>У вас нет прав доступа к этой команде!</strong>", parse_mode=ParseMode.HTML)
+        reply(update, "❌ <strong>У вас нет прав доступа к этой команде!</strong>", parse_mode=ParseMode.HTML)
         return
 
-    queue = student_queue.get_queue()
-    total_students = len(queue)
+    key = command_queue_key(update, context)
+    shard = queues.get(key)
+    total_students = len(shard.queue)
     
     admin_text = f"""
 ⚙️ <strong>Панель управления преподавателя</strong>
 
 📊 <strong>Статистика:</strong>
 👥 Студентов в очереди: <strong>{total_students}</strong>
-
+{service_text(key, total_students)}
 🛠️ <strong>Действия:</strong>
 • Используй /next чтобы вызвать следующего студента
 • Просматривай очередь командой /queue
@@ -199,18 +997,20 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
 
     keyboard = [
-        [InlineKeyboardButton("✅ Следующий студент", callback_data="next")],
-        [InlineKeyboardButton("📋 Показать очередь", callback_data="queue")],
-        [InlineKeyboardButton("🔄 Обновить статистику", callback_data="admin")],
-        [InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")]
+        [InlineKeyboardButton("✅ Следующий студент", callback_data=cb("next", key))],
+        [InlineKeyboardButton("📋 Показать очередь", callback_data=cb("queue", key))],
+        [InlineKeyboardButton("🔄 Обновить статистику", callback_data=cb("admin", key))],
+        [InlineKeyboardButton("🔬 Профилирование", callback_data=cb("profile", key))],
+        [InlineKeyboardButton("🏠 Главное меню", callback_data=cb("main_menu", key))]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    await update.message.reply_text(admin_text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+    reply(update, admin_text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
 
 # Команда /help
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
+    key = command_queue_key(update, context)
     
     help_text = """
 <strong>📖 Инструкция по использованию бота:</strong>
@@ -220,6 +1020,8 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 ✅ <strong>/leave</strong> - выйти из очереди (если передумал)
 ✅ <strong>/queue</strong> - посмотреть всю очередь
 ✅ <strong>/position</strong> - узнать свою позицию
+✅ <strong>/join lab3</strong> - встать в очередь конкретной лабораторной
+✅ <strong>/surname</strong> - сменить сохранённую фамилию
     """
 
     # Для администратора добавляем информацию
@@ -228,6 +1030,14 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 <strong>Для преподавателя:</strong>
 👨‍🏫 <strong>/next</strong> - отметить, что текущий студент сдал работу
 👨‍🏫 <strong>/admin</strong> - открыть панель управления
+👨‍🏫 <strong>/board</strong> - закрепить в чате табло очереди (/board off - убрать)
+👨‍🏫 <strong>/find фамилия</strong> - найти студентов по началу фамилии, имени или username
+👨‍🏫 <strong>/remove фамилия|#позиция</strong> - убрать студента из очереди
+👨‍🏫 <strong>/move фамилия|#позиция позиция</strong> - переставить студента
+👨‍🏫 <strong>/import</strong> - загрузить список студентов (файл queue.json или фамилии по строкам)
+👨‍🏫 <strong>/clear</strong> - очистить очередь, <strong>/shuffle</strong> - перемешать её
+👨‍🏫 <strong>/export [ГГГГ-ММ-ДД [ГГГГ-ММ-ДД]] [лабораторная|all]</strong> - история очереди в CSV
+👨‍🏫 <strong>/profile [секунд] [flame]</strong> - профилирование бота с отчётом документом
         """
 
     help_text += """
@@ -235,158 +1045,186 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
 
     keyboard = [
-        [InlineKeyboardButton("📝 Встать в очередь", callback_data="join")],
-        [InlineKeyboardButton("📋 Показать очередь", callback_data="queue")],
+        [InlineKeyboardButton("📝 Встать в очередь", callback_data=cb("join", key))],
+        [InlineKeyboardButton("📋 Показать очередь", callback_data=cb("queue", key))],
     ]
 
     if is_admin(user.id):
-        keyboard.append([InlineKeyboardButton("⚙️ Панель управления", callback_data="admin")])
+        keyboard.append([InlineKeyboardButton("⚙️ Панель управления", callback_data=cb("admin", key))])
 
-    keyboard.append([InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")])
+    keyboard.append([InlineKeyboardButton("🏠 Главное меню", callback_data=cb("main_menu", key))])
 
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    await update.message.reply_text(help_text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+    reply(update, help_text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
 
-# Обработчик ввода фамилии
-async def handle_surname_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = update.effective_user
-    surname = update.message.text.strip()
-    
-    if user.id in pending_surnames:
-        username = f"@{user.username}" if user.username else user.first_name
-        
-        if student_queue.add_student(user.id, username, user.first_name, surname):
-            position = student_queue.get_position(user.id)
-            total = len(student_queue.get_queue())
+# Запись студента в очередь — общая для ввода фамилии и /join с сохранённой фамилией
+async def enqueue_student(user, key: str, surname: str):
+    """Добавление студента в очередь key; текст и клавиатура ответа"""
+    shard = queues.get(key)
+    username = f"@{user.username}" if user.username else user.first_name
+
+    if not await shard.actor.call('add_student', user.id, username, user.first_name, surname):
+        return "❌ <strong>Ты уже в очереди!</strong>\nИспользуй /position чтобы узнать свою позицию", None
 
-            success_text = f"""
+    queue_event(key, "join", shard.queue.get_student(user.id))
+    position = shard.queue.get_position(user.id)
+    total = len(shard.queue)
+
+    success_text = f"""
 ✅ <strong>Ты успешно добавлен в очередь!</strong>
 
 📊 <strong>Информация:</strong>
 🎯 Твоя позиция: <strong>{position}</strong>
 👥 Всего в очереди: <strong>{total}</strong>
-📝 <strong>Фамилия:</strong> {surname}
+📝 <strong>Фамилия:</strong> {html.escape(surname)}
 
 <em>Используй /position чтобы проверить свою позицию
-Или /queue чтобы посмотреть всю очередь</em>
-            """
+Или /queue чтобы посмотреть всю очередь
+Сменить фамилию: /surname</em>
+    """
 
-            keyboard = [
-                [InlineKeyboardButton("📋 Посмотреть очередь", callback_data="queue")],
-                [InlineKeyboardButton("🔍 Моя позиция", callback_data="position")],
-                [InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+    keyboard = [
+        [InlineKeyboardButton("📋 Посмотреть очередь", callback_data=cb("queue", key))],
+        [InlineKeyboardButton("🔍 Моя позиция", callback_data=cb("position", key))],
+        [InlineKeyboardButton("🏠 Главное меню", callback_data=cb("main_menu", key))]
+    ]
+    return success_text, InlineKeyboardMarkup(keyboard)
 
-            await update.message.reply_text(success_text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
-            
-            del pending_surnames[user.id]
-        else:
-            await update.message.reply_text(
-                "❌ <strong>Ты уже в очереди!</strong>\nИспользуй /position чтобы узнать свою позицию",
-                parse_mode=ParseMode.HTML)
-            del pending_surnames[user.id]
+# Сохранённая фамилия студента, если она есть
+async def saved_surname(user_id: int):
+    profile = await profiles.get(user_id)
+    return profile.get('surname') if profile else None
+
+# Обработчик ввода фамилии
+async def handle_surname_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    surname = update.message.text.strip()
+
+    # Смена сохранённой фамилии после /surname
+    if conversations.state(user.id) == "rename":
+        conversations.discard(user.id)
+        await profiles.set_surname(user.id, surname)
+        reply(update,
+            f"✅ <strong>Фамилия сохранена:</strong> {html.escape(surname)}\n\n"
+            "<em>Она будет использоваться при следующих записях в очередь</em>",
+            parse_mode=ParseMode.HTML
+        )
+        return
+
+    # Список фамилий текстом после /import
+    key = conversations.pop(user.id, "import")
+    if key is not None:
+        await import_roster(update, key, update.message.text.encode('utf-8'))
+        return
+
+    # pop сразу забирает ожидание фамилии, чтобы два параллельных сообщения не добавили студента дважды
+    key = conversations.pop(user.id, "surname")
+    if key is not None:
+        await profiles.set_surname(user.id, surname)
+        text, reply_markup = await enqueue_student(user, key, surname)
+        reply(update, text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
 
 # Команда встать в очередь
 async def join_queue(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
+    key = command_queue_key(update, context)
+    shard = queues.get(key)
     
-    if student_queue.get_position(user.id):
-        await update.message.reply_text(
+    if shard.queue.get_position(user.id):
+        reply(update,
             "❌ <strong>Ты уже в очереди!</strong>\nИспользуй /position чтобы узнать свою позицию",
             parse_mode=ParseMode.HTML)
         return
+
+    # Фамилию вернувшегося студента уже знаем — записываем сразу
+    surname = await saved_surname(user.id)
+    if surname:
+        text, reply_markup = await enqueue_student(user, key, surname)
+        reply(update, text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+        return
     
-    pending_surnames[user.id] = True
+    conversations.set(user.id, "surname", key)
     
-    await update.message.reply_text(
+    reply(update,
         "📝 <strong>Пожалуйста, введи свою фамилию:</strong>\n\n"
         "<em>Это нужно для того, чтобы преподаватель мог идентифицировать тебя</em>",
         parse_mode=ParseMode.HTML
     )
 
+# Команда /surname [фамилия] - сменить сохранённую фамилию
+async def surname_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+
+    if context.args:
+        surname = " ".join(context.args)
+        await profiles.set_surname(user.id, surname)
+        reply(update,
+            f"✅ <strong>Фамилия сохранена:</strong> {html.escape(surname)}\n\n"
+            "<em>Она будет использоваться при следующих записях в очередь</em>",
+            parse_mode=ParseMode.HTML
+        )
+        return
+
+    conversations.set(user.id, "rename")
+    reply(update,
+        "📝 <strong>Введи новую фамилию:</strong>\n\n"
+        "<em>Она будет использоваться при следующих записях в очередь</em>",
+        parse_mode=ParseMode.HTML
+    )
+
 # Команда покинуть очередь
 async def leave_queue(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
+    shard = queues.get(command_queue_key(update, context))
 
-    if student_queue.remove_student(user.id):
-        await update.message.reply_text("✅ <strong>Ты удален из очереди!</strong>", parse_mode=ParseMode.HTML)
+    removed = await shard.actor.call('remove_student', user.id)
+    if removed:
+        queue_event(shard.key, "leave", removed)
+        reply(update, "✅ <strong>Ты удален из очереди!</strong>", parse_mode=ParseMode.HTML)
     else:
-        await update.message.reply_text("❌ <strong>Тебя нет в очереди!</strong>", parse_mode=ParseMode.HTML)
+        reply(update, "❌ <strong>Тебя нет в очереди!</strong>", parse_mode=ParseMode.HTML)
 
 # Команда показать очередь
 async def show_queue(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    queue = student_queue.get_queue()
+    shard = queues.get(command_queue_key(update, context))
+    queue_text, reply_markup = render_queue_page(shard, 1, is_admin(update.effective_user.id))
 
-    if not queue:
-        queue_text = "📝 <strong>Очередь пуста!</strong>\n\nИспользуй /join чтобы встать в очередь"
-
-        keyboard = [
-            [InlineKeyboardButton("📝 Встать в очередь", callback_data="join")],
-            [InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
-        await update.message.reply_text(queue_text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
-        return
-
-    queue_text = "📋 <strong>Текущая очередь:</strong>\n\n"
-    for i, student in enumerate(queue, 1):
-        display_name = get_display_name(student)
-        queue_text += f"<strong>{i}.</strong> {display_name}\n"
-
-    queue_text += f"\n👥 <strong>Всего в очереди:</strong> {len(queue)}"
-
-    keyboard = [
-        [InlineKeyboardButton("📝 Встать в очередь", callback_data="join")],
-        [InlineKeyboardButton("🔍 Моя позиция", callback_data="position")],
-    ]
-
-    # Только для администратора добавляем кнопку управления
-    if is_admin(update.effective_user.id):
-        keyboard.append([InlineKeyboardButton("⚙️ Панель управления", callback_data="admin")])
-
-    keyboard.append([InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")])
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    await update.message.reply_text(queue_text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+    reply(update, queue_text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
 
 # Команда узнать свою позицию
 async def get_position(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    position = student_queue.get_position(user.id)
+    key = command_queue_key(update, context)
+    shard = queues.get(key)
+    position = shard.queue.get_position(user.id)
 
     if position:
-        total = len(student_queue.get_queue())
-        student_data = None
-        for student in student_queue.get_queue():
-            if student['user_id'] == user.id:
-                student_data = student
-                break
-        
+        total = len(shard.queue)
+        student_data = shard.queue.get_student(user.id)
+
         position_text = f"""
 🔍 <strong>Информация о твоей позиции:</strong>
 
 🎯 <strong>Твоя позиция:</strong> {position}
 👥 <strong>Всего в очереди:</strong> {total}
 """
-        if student_data and student_data.get('surname'):
-            position_text += f"📝 <strong>Фамилия:</strong> {student_data['surname']}\n"
+        position_text += wait_text(key, position)
+        if student_data and student_data.surname:
+            position_text += f"📝 <strong>Фамилия:</strong> {html.escape(student_data.surname)}\n"
 
         position_text += "\n<em>Используй /queue чтобы посмотреть всю очередь</em>"
 
         keyboard = [
-            [InlineKeyboardButton("📋 Посмотреть очередь", callback_data="queue")],
-            [InlineKeyboardButton("❌ Покинуть очередь", callback_data="leave")],
-            [InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")]
+            [InlineKeyboardButton("📋 Посмотреть очередь", callback_data=cb("queue", key))],
+            [InlineKeyboardButton("❌ Покинуть очередь", callback_data=cb("leave", key))],
+            [InlineKeyboardButton("🏠 Главное меню", callback_data=cb("main_menu", key))]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
 
-        await update.message.reply_text(position_text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+        reply(update, position_text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
     else:
-        await update.message.reply_text(
+        reply(update,
             "❌ <strong>Тебя нет в очереди!</strong>\nИспользуй /join чтобы встать в очередь",
             parse_mode=ParseMode.HTML
         )
@@ -397,18 +1235,21 @@ async def next_student(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Проверка прав доступа
     if not is_admin(user.id):
-        await update.message.reply_text(
+        reply(update,
             "❌ <strong>Эта команда доступна только преподавателю!</strong>",
             parse_mode=ParseMode.HTML
         )
         return
 
-    removed_student = student_queue.remove_first()
+    key = command_queue_key(update, context)
+    shard = queues.get(key)
+    removed_student = await shard.actor.call('remove_first')
 
     if removed_student:
-        queue = student_queue.get_queue()
+        queue_event(key, "next", removed_student)
+        queue = shard.queue
 
-        display_name = get_display_name(removed_student)
+        display_name = html.escape(removed_student.display_name)
         
         next_text = f"""
 ✅ <strong>Студент удален из очереди!</strong>
@@ -418,137 +1259,476 @@ async def next_student(update: Update, context: ContextTypes.DEFAULT_TYPE):
         """
 
         if queue:
-            next_student = queue[0]
-            next_display_name = get_display_name(next_student)
+            next_student = queue.student_at(1)
+            next_display_name = html.escape(next_student.display_name)
             next_text += f"\n🎯 <strong>Следующий:</strong> {next_display_name}"
 
-            if next_student.get('user_id'):
-                try:
-                    await context.bot.send_message(
-                        chat_id=next_student['user_id'],
-                        text="🎯 <strong>Ты следующий в очереди! Подготовься к сдаче.</strong>",
-                        parse_mode=ParseMode.HTML
-                    )
-                except Exception as e:
-                    logger.error(f"Не удалось отправить уведомление: {e}")
+            # Уведомления уходят в фоне и не задерживают ответ преподавателю
+            notify_front(shard)
 
         keyboard = [
-            [InlineKeyboardButton("📋 Показать очередь", callback_data="queue")],
-            [InlineKeyboardButton("✅ Следующий", callback_data="next")],
-            [InlineKeyboardButton("⚙️ Панель управления", callback_data="admin")],
-            [InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")]
+            [InlineKeyboardButton("📋 Показать очередь", callback_data=cb("queue", key))],
+            [InlineKeyboardButton("✅ Следующий", callback_data=cb("next", key))],
+            [InlineKeyboardButton("⚙️ Панель управления", callback_data=cb("admin", key))],
+            [InlineKeyboardButton("🏠 Главное меню", callback_data=cb("main_menu", key))]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
 
-        await update.message.reply_text(next_text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+        reply(update, next_text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
     else:
-        await update.message.reply_text("❌ <strong>Очередь пуста!</strong>", parse_mode=ParseMode.HTML)
+        reply(update, "❌ <strong>Очередь пуста!</strong>", parse_mode=ParseMode.HTML)
+
+# Поиск студента для команд преподавателя: номер позиции или начало фамилии, имени, username
+def locate_student(queue, query: str):
+    """(позиция, запись) найденного студента или (None, список совпадений [(позиция, запись)])"""
+    query = query.strip()
+    if query.lstrip('#').isdigit():
+        position = int(query.lstrip('#'))
+        student = queue.student_at(position)
+        return (position, student) if student else (None, [])
+    matches = queue.find(query, FIND_LIMIT + 1)
+    if len(matches) == 1:
+        return matches[0]
+    return None, matches
+
+def format_matches(matches) -> str:
+    """Список совпадений с позициями"""
+    lines = [f"{position}. {html.escape(student.display_name)}" for position, student in matches[:FIND_LIMIT]]
+    if len(matches) > FIND_LIMIT:
+        lines.append(f"… показаны первые {FIND_LIMIT}, уточни запрос")
+    return "\n".join(lines)
+
+def ambiguous_text(query: str, matches) -> str:
+    """Ответ, когда запрос не указывает на одного студента"""
+    if not matches:
+        return f"❌ <strong>В очереди нет студента «{html.escape(query)}»</strong>"
+    return (f"🔎 <strong>Под запрос «{html.escape(query)}» подходят несколько студентов</strong>\n\n"
+            f"{format_matches(matches)}\n\nУкажи позицию, например <strong>#{matches[0][0]}</strong>")
+
+# Команда /find - поиск студентов в очереди, ТОЛЬКО ДЛЯ АДМИНИСТРАТОРА
+async def find_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
 
-# Обработчик нажатий на кнопки
-async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
+    if not is_admin(user.id):
+        reply(update, "❌ <strong>Эта команда доступна только преподавателю!</strong>", parse_mode=ParseMode.HTML)
+        return
 
-    user = query.from_user
+    query = " ".join(context.args)
+    if not query:
+        reply(update, "🔎 <strong>Использование:</strong> /find фамилия, имя или username", parse_mode=ParseMode.HTML)
+        return
 
-    if query.data == "join":
-        if student_queue.get_position(user.id):
-            await query.edit_message_text("❌ <strong>Ты уже в очереди!</strong>", parse_mode=ParseMode.HTML)
-            return
-        
-        pending_surnames[user.id] = True
-        
-        await query.edit_message_text(
-            "📝 <strong>Пожалуйста, введи свою фамилию:</strong>\n\n"
-            "<em>Это нужно для того, чтобы преподаватель мог идентифицировать тебя</em>",
+    key = resolve_queue_key(update, context)
+    matches = queues.get(key).queue.find(query, FIND_LIMIT + 1)
+    if not matches:
+        reply(update, f"❌ <strong>В очереди{queue_title(key)} нет студента «{html.escape(query)}»</strong>",
+              parse_mode=ParseMode.HTML)
+        return
+    reply(update, f"🔎 <strong>Найдено в очереди{queue_title(key)}:</strong>\n\n{format_matches(matches)}",
+          parse_mode=ParseMode.HTML)
+
+# Команда /remove - удаление студента из очереди по фамилии или позиции, ТОЛЬКО ДЛЯ АДМИНИСТРАТОРА
+async def remove_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+
+    if not is_admin(user.id):
+        reply(update, "❌ <strong>Эта команда доступна только преподавателю!</strong>", parse_mode=ParseMode.HTML)
+        return
+
+    query = " ".join(context.args)
+    if not query:
+        reply(update, "🗑 <strong>Использование:</strong> /remove фамилия или /remove #позиция", parse_mode=ParseMode.HTML)
+        return
+
+    key = resolve_queue_key(update, context)
+    shard = queues.get(key)
+    position, found = locate_student(shard.queue, query)
+    if position is None:
+        reply(update, ambiguous_text(query, found), parse_mode=ParseMode.HTML)
+        return
+
+    # Если к моменту изменения на этой позиции оказался другой студент, ничего не удаляем
+    removed = await shard.actor.call('remove_at', position, found)
+    if removed is None:
+        reply(update, "⚠️ <strong>Очередь изменилась, повтори команду</strong>", parse_mode=ParseMode.HTML)
+        return
+
+    queue_event(key, "remove", removed)
+    if position <= NOTIFY_TOP_K:
+        notify_front(shard)
+    reply(update,
+        f"🗑 <strong>Удален из очереди{queue_title(key)}:</strong> {html.escape(removed.display_name)} "
+        f"(был {position}-м)\n👥 <strong>Осталось в очереди:</strong> {len(shard.queue)}",
+        parse_mode=ParseMode.HTML
+    )
+
+# Команда /move - перестановка студента в очереди, ТОЛЬКО ДЛЯ АДМИНИСТРАТОРА
+async def move_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+
+    if not is_admin(user.id):
+        reply(update, "❌ <strong>Эта команда доступна только преподавателю!</strong>", parse_mode=ParseMode.HTML)
+        return
+
+    if len(context.args) < 2 or not context.args[-1].lstrip('#').isdigit():
+        reply(update, "↕️ <strong>Использование:</strong> /move фамилия позиция или /move #позиция позиция",
+              parse_mode=ParseMode.HTML)
+        return
+
+    query = " ".join(context.args[:-1])
+    key = resolve_queue_key(update, context)
+    shard = queues.get(key)
+    position, found = locate_student(shard.queue, query)
+    if position is None:
+        reply(update, ambiguous_text(query, found), parse_mode=ParseMode.HTML)
+        return
+
+    new_position = min(max(int(context.args[-1].lstrip('#')), 1), len(shard.queue))
+    moved = await shard.actor.call('move', position, new_position, found)
+    if moved is None:
+        reply(update, "⚠️ <strong>Очередь изменилась, повтори команду</strong>", parse_mode=ParseMode.HTML)
+        return
+
+    queue_event(key, "move", moved)
+    if min(position, new_position) <= NOTIFY_TOP_K:
+        notify_front(shard)
+    reply(update,
+        f"↕️ <strong>{html.escape(moved.display_name)}</strong> перемещен с {position}-й "
+        f"на {new_position}-ю позицию в очереди{queue_title(key)}",
+        parse_mode=ParseMode.HTML
+    )
+
+# Разбор списка студентов для /import
+def parse_roster(data: bytes):
+    """Записи студентов из JSON-списка в формате queue.json или текста с фамилией в каждой строке"""
+    text = data.decode('utf-8-sig')
+    if not text.lstrip().startswith('['):
+        return [Student(None, None, "", line.strip()) for line in text.splitlines() if line.strip()]
+
+    students = []
+    for item in json.loads(text):
+        if not isinstance(item, dict):
+            raise ValueError("каждый элемент списка должен быть объектом")
+        user_id = item.get('user_id')
+        if user_id is not None and not isinstance(user_id, int):
+            raise ValueError(f"некорректный user_id: {user_id!r}")
+        students.append(Student(user_id, item.get('username'), item.get('first_name') or "", item.get('surname') or ""))
+    return students
+
+async def import_roster(update: Update, key: str, data: bytes):
+    """Добавление списка студентов в очередь key одной транзакцией"""
+    try:
+        students = parse_roster(data)
+    except ValueError as e:
+        reply(update, f"❌ <strong>Не удалось разобрать список:</strong> {html.escape(str(e))}", parse_mode=ParseMode.HTML)
+        return
+
+    shard = queues.get(key)
+    added = await shard.actor.call('import_students', students)
+    if added:
+        queue_event(key, "import", *added)
+    reply(update,
+        f"📥 <strong>Импортировано в очередь{queue_title(key)}:</strong> {len(added)} из {len(students)}\n"
+        f"👥 <strong>Всего в очереди:</strong> {len(shard.queue)}",
+        parse_mode=ParseMode.HTML
+    )
+
+async def import_document(update: Update, context: ContextTypes.DEFAULT_TYPE, key: str, document):
+    """Скачивание файла со списком студентов и импорт"""
+    if document.file_size and document.file_size > IMPORT_MAX_BYTES:
+        reply(update, f"❌ <strong>Файл больше {IMPORT_MAX_BYTES // 1024} КБ</strong>", parse_mode=ParseMode.HTML)
+        return
+    try:
+        file = await context.bot.get_file(document.file_id)
+        data = bytes(await file.download_as_bytearray())
+    except TelegramError as e:
+        logger.error(f"Не удалось скачать список студентов: {e}")
+        reply(update, "❌ <strong>Не удалось скачать файл, попробуй ещё раз</strong>", parse_mode=ParseMode.HTML)
+        return
+    await import_roster(update, key, data)
+
+# Команда /import - загрузка списка студентов, ТОЛЬКО ДЛЯ АДМИНИСТРАТОРА
+async def import_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+
+    if not is_admin(user.id):
+        reply(update, "❌ <strong>Эта команда доступна только преподавателю!</strong>", parse_mode=ParseMode.HTML)
+        return
+
+    key = resolve_queue_key(update, context)
+    # Фамилии можно перечислить прямо в команде, по одной на строке после /import
+    lines = update.message.text.partition('\n')[2]
+    if lines.strip():
+        await import_roster(update, key, lines.encode('utf-8'))
+        return
+
+    # Или ответить командой на сообщение с файлом
+    replied = update.message.reply_to_message
+    if replied is not None and replied.document is not None:
+        await import_document(update, context, key, replied.document)
+        return
+
+    conversations.set(user.id, "import", key)
+    reply(update,
+        f"📥 <strong>Отправь список студентов для очереди{queue_title(key)}</strong>\n\n"
+        "<em>Файл в формате queue.json или фамилии по одной на строке</em>",
+        parse_mode=ParseMode.HTML
+    )
+
+# Файл со списком студентов после /import
+async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    key = conversations.pop(user.id, "import")
+    if key is not None and is_admin(user.id):
+        await import_document(update, context, key, update.message.document)
+
+# Команда /clear - очистка очереди с подтверждением, ТОЛЬКО ДЛЯ АДМИНИСТРАТОРА
+async def clear_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+
+    if not is_admin(user.id):
+        reply(update, "❌ <strong>Эта команда доступна только преподавателю!</strong>", parse_mode=ParseMode.HTML)
+        return
+
+    key = command_queue_key(update, context)
+    count = len(queues.get(key).queue)
+    if not count:
+        reply(update, "❌ <strong>Очередь пуста!</strong>", parse_mode=ParseMode.HTML)
+        return
+
+    keyboard = [
+        [InlineKeyboardButton("🗑 Да, очистить", callback_data=cb("clear", key))],
+        [InlineKeyboardButton("⚙️ Панель управления", callback_data=cb("admin", key))]
+    ]
+    reply(update,
+        f"⚠️ <strong>Очистить очередь{queue_title(key)}?</strong>\n\nБудут удалены все студенты: {count}",
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode=ParseMode.HTML
+    )
+
+# Команда /shuffle - случайный порядок очереди, ТОЛЬКО ДЛЯ АДМИНИСТРАТОРА
+async def shuffle_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+
+    if not is_admin(user.id):
+        reply(update, "❌ <strong>Эта команда доступна только преподавателю!</strong>", parse_mode=ParseMode.HTML)
+        return
+
+    key = command_queue_key(update, context)
+    shard = queues.get(key)
+    count = await shard.actor.call('shuffle')
+    if not count:
+        reply(update, "❌ <strong>Очередь пуста!</strong>", parse_mode=ParseMode.HTML)
+        return
+
+    queue_event(key, "shuffle")
+    notify_front(shard)
+    reply(update, f"🔀 <strong>Очередь{queue_title(key)} перемешана</strong>\n👥 <strong>Студентов:</strong> {count}",
+          parse_mode=ParseMode.HTML)
+
+# Команда /export - выгрузка истории очереди в CSV, ТОЛЬКО ДЛЯ АДМИНИСТРАТОРА
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+
+    if not is_admin(user.id):
+        reply(update, "❌ <strong>Эта команда доступна только преподавателю!</strong>", parse_mode=ParseMode.HTML)
+        return
+
+    # Аргументы: одна дата — этот день, две — диапазон включительно; лабораторная или all — какие очереди
+    key = resolve_queue_key(update, context)
+    dates = []
+    for arg in context.args:
+        if DATE_RE.match(arg) and len(dates) < 2:
+            try:
+                dates.append(datetime.strptime(arg, "%Y-%m-%d"))
+                continue
+            except ValueError:
+                pass
+        elif arg.lower() == "all":
+            key = None
+            continue
+        elif valid_lab_name(arg) and not DATE_RE.match(arg):
+            key = resolve_queue_key(update, context, arg)
+            continue
+        reply(update,
+            "📤 <strong>Использование:</strong> /export [ГГГГ-ММ-ДД [ГГГГ-ММ-ДД]] [лабораторная|all]",
             parse_mode=ParseMode.HTML
         )
+        return
+    since = dates[0].timestamp() if dates else None
+    until = (dates[-1] + timedelta(days=1)).timestamp() if dates else None
 
-    elif query.data == "leave":
-        if student_queue.remove_student(user.id):
-            await query.edit_message_text("✅ <strong>Ты удален из очереди!</strong>", parse_mode=ParseMode.HTML)
+    fd, path = tempfile.mkstemp(prefix="export-", suffix=".csv")
+    os.close(fd)
+    try:
+        rows, complete = await history.export_csv(path, since, until, key, EXPORT_MAX_BYTES)
+    except OSError as e:
+        os.remove(path)
+        logger.error(f"Ошибка выгрузки истории: {e}")
+        reply(update, "❌ <strong>Не удалось выгрузить историю</strong>", parse_mode=ParseMode.HTML)
+        return
+
+    if not rows:
+        os.remove(path)
+        reply(update, "📭 <strong>За этот период событий нет</strong>", parse_mode=ParseMode.HTML)
+        return
+
+    period = " — ".join(dict.fromkeys(date.strftime("%Y-%m-%d") for date in dates)) or "всё время"
+    caption = f"📤 История {'всех очередей' if key is None else 'очереди' + queue_title(key)}: {period}, событий {rows}"
+    if not complete:
+        caption += f"\n⚠️ Выгрузка обрезана до {EXPORT_MAX_BYTES >> 20} МБ, сузь период"
+    # Файл передаётся путём: при повторной отправке outbox прочитает его заново
+    chat_id = update.effective_chat.id
+    future = outbox.submit(
+        chat_id, 'send_document', PRIORITY_HIGH, chat_id=chat_id,
+        document=Path(path), filename=f"history-{key or 'all'}-{time.strftime('%Y%m%d-%H%M%S')}.csv", caption=caption
+    )
+    # Файл удаляется, когда отправка завершилась — успешно, с ошибкой или сообщение отброшено
+    future.add_done_callback(lambda _: os.remove(path))
+
+# Команда /board - живое табло очереди в чате, ТОЛЬКО ДЛЯ АДМИНИСТРАТОРА
+async def board_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+
+    if not is_admin(user.id):
+        reply(update,
+            "❌ <strong>Эта команда доступна только преподавателю!</strong>",
+            parse_mode=ParseMode.HTML
+        )
+        return
+
+    chat_id = update.effective_chat.id
+    if context.args and context.args[0].lower() == "off":
+        if await boards.remove(chat_id):
+            reply(update, "✅ <strong>Табло отключено</strong>", parse_mode=ParseMode.HTML)
         else:
-            await query.edit_message_text("❌ <strong>Тебя нет в очереди!</strong>", parse_mode=ParseMode.HTML)
+            reply(update, "❌ <strong>В этом чате нет табло!</strong>", parse_mode=ParseMode.HTML)
+        return
 
-    elif query.data == "queue":
-        queue = student_queue.get_queue()
-        if not queue:
-            queue_text = "📝 <strong>Очередь пуста!</strong>"
+    error = await boards.create(chat_id, command_queue_key(update, context))
+    if error is not None:
+        reply(update,
+            f"❌ <strong>Не удалось закрепить табло:</strong> {html.escape(str(error))}\n"
+            "<em>Бот должен быть администратором чата с правом закреплять сообщения</em>",
+            parse_mode=ParseMode.HTML
+        )
 
-            keyboard = [
-                [InlineKeyboardButton("📝 Встать в очередь", callback_data="join")],
-                [InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+# Команда /profile [секунд] [flame] - профилирование бота, ТОЛЬКО ДЛЯ АДМИНИСТРАТОРА
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
 
-            await query.edit_message_text(queue_text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
-            return
+    if not is_admin(user.id):
+        reply(update,
+            "❌ <strong>Эта команда доступна только преподавателю!</strong>",
+            parse_mode=ParseMode.HTML
+        )
+        return
 
-        queue_text = "📋 <strong>Текущая очередь:</strong>\n\n"
-        for i, student in enumerate(queue, 1):
-            display_name = get_display_name(student)
-            queue_text += f"<strong>{i}.</strong> {display_name}\n"
+    args = [arg.lower() for arg in context.args or []]
+    seconds = PROFILE_SECONDS
+    if args and args[0].isdigit():
+        seconds = min(max(int(args[0]), 1), PROFILE_MAX_SECONDS)
+    reply(update, start_profile(update.effective_chat.id, seconds, "flame" in args), parse_mode=ParseMode.HTML)
 
-        queue_text += f"\n👥 <strong>Всего в очереди:</strong> {len(queue)}"
+# Обработчик нажатий на кнопки
+async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    view = await render_button(update, context)
+    if view is None or query.message is None:
+        await query.answer()
+        return
 
-        keyboard = [
-            [InlineKeyboardButton("📝 Встать в очередь", callback_data="join")],
-            [InlineKeyboardButton("🔍 Моя позиция", callback_data="position")],
-        ]
+    text, reply_markup = view
+    # Сообщение уже так выглядит (например, "Обновить статистику" без изменений в очереди):
+    # вместо правки, на которую Telegram ответил бы "message is not modified", — подсказка
+    if not edit_cache.changed(query.message.chat_id, query.message.message_id, text, reply_markup):
+        await query.answer("Ничего не изменилось")
+        return
 
-        if is_admin(user.id):
-            keyboard.append([InlineKeyboardButton("⚙️ Панель управления", callback_data="admin")])
+    await query.answer()
+    edit(update, text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
 
-        keyboard.append([InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")])
+# Действие кнопки: выполняет его и возвращает новый вид сообщения (текст и клавиатуру)
+async def render_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    user = query.from_user
+    # Кнопки несут ключ очереди и аргумент: "queue|lab_lab3|2"; у старых кнопок их нет
+    action, _, rest = query.data.partition('|')
+    key, _, arg = rest.partition('|')
+    if not key:
+        key = resolve_queue_key(update, context)
+    elif not valid_queue_key(key):
+        logger.warning(f"Кнопка с неизвестной очередью от пользователя {user.id}")
+        return None
+    shard = queues.get(key)
 
-        reply_markup = InlineKeyboardMarkup(keyboard)
+    if action == "join":
+        if shard.queue.get_position(user.id):
+            return "❌ <strong>Ты уже в очереди!</strong>", None
+
+        surname = await saved_surname(user.id)
+        if surname:
+            return await enqueue_student(user, key, surname)
+        
+        conversations.set(user.id, "surname", key)
+        
+        return (
+            "📝 <strong>Пожалуйста, введи свою фамилию:</strong>\n\n"
+            "<em>Это нужно для того, чтобы преподаватель мог идентифицировать тебя</em>"
+        ), None
+
+    elif action == "leave":
+        removed = await shard.actor.call('remove_student', user.id)
+        if removed:
+            queue_event(key, "leave", removed)
+            return "✅ <strong>Ты удален из очереди!</strong>", None
+        else:
+            return "❌ <strong>Тебя нет в очереди!</strong>", None
 
-        await query.edit_message_text(queue_text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+    elif action == "queue":
+        page = int(arg) if arg.isdigit() else 1
+        queue_text, reply_markup = render_queue_page(shard, page, is_admin(user.id))
 
-    elif query.data == "position":
-        position = student_queue.get_position(user.id)
+        return queue_text, reply_markup
+
+    elif action == "position":
+        position = shard.queue.get_position(user.id)
         if position:
-            total = len(student_queue.get_queue())
-            student_data = None
-            for student in student_queue.get_queue():
-                if student['user_id'] == user.id:
-                    student_data = student
-                    break
-            
+            total = len(shard.queue)
+            student_data = shard.queue.get_student(user.id)
+
             position_text = f"""
 🔍 <strong>Информация о твоей позиции:</strong>
 
 🎯 <strong>Твоя позиция:</strong> {position}
 👥 <strong>Всего в очереди:</strong> {total}
 """
-            if student_data and student_data.get('surname'):
-                position_text += f"📝 <strong>Фамилия:</strong> {student_data['surname']}\n"
+            position_text += wait_text(key, position)
+            if student_data and student_data.surname:
+                position_text += f"📝 <strong>Фамилия:</strong> {html.escape(student_data.surname)}\n"
 
             keyboard = [
-                [InlineKeyboardButton("📋 Посмотреть очередь", callback_data="queue")],
-                [InlineKeyboardButton("❌ Покинуть очередь", callback_data="leave")],
-                [InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")]
+                [InlineKeyboardButton("📋 Посмотреть очередь", callback_data=cb("queue", key))],
+                [InlineKeyboardButton("❌ Покинуть очередь", callback_data=cb("leave", key))],
+                [InlineKeyboardButton("🏠 Главное меню", callback_data=cb("main_menu", key))]
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
 
-            await query.edit_message_text(position_text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+            return position_text, reply_markup
         else:
-            await query.edit_message_text("❌ <strong>Тебя нет в очереди!</strong>", parse_mode=ParseMode.HTML)
+            return "❌ <strong>Тебя нет в очереди!</strong>", None
 
-    elif query.data == "next":
+    elif action == "next":
         # Проверка прав доступа для кнопки "Следующий"
         if not is_admin(user.id):
-            await query.edit_message_text(
-                "❌ <strong>Эта функция доступна только преподавателю!</strong>",
-                parse_mode=ParseMode.HTML
-            )
-            return
+            return "❌ <strong>Эта функция доступна только преподавателю!</strong>", None
 
-        removed_student = student_queue.remove_first()
+        removed_student = await shard.actor.call('remove_first')
         if removed_student:
-            queue = student_queue.get_queue()
+            queue_event(key, "next", removed_student)
+            queue = shard.queue
 
-            display_name = get_display_name(removed_student)
+            display_name = html.escape(removed_student.display_name)
             
             next_text = f"""
 ✅ <strong>Студент удален из очереди!</strong>
@@ -558,56 +1738,77 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             """
 
             if queue:
-                next_student = queue[0]
-                next_display_name = get_display_name(next_student)
+                next_student = queue.student_at(1)
+                next_display_name = html.escape(next_student.display_name)
                 next_text += f"\n🎯 <strong>Следующий:</strong> {next_display_name}"
 
+                notify_front(shard)
+
             keyboard = [
-                [InlineKeyboardButton("📋 Показать очередь", callback_data="queue")],
-                [InlineKeyboardButton("✅ Следующий", callback_data="next")],
-                [InlineKeyboardButton("⚙️ Панель управления", callback_data="admin")],
-                [InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")]
+                [InlineKeyboardButton("📋 Показать очередь", callback_data=cb("queue", key))],
+                [InlineKeyboardButton("✅ Следующий", callback_data=cb("next", key))],
+                [InlineKeyboardButton("⚙️ Панель управления", callback_data=cb("admin", key))],
+                [InlineKeyboardButton("🏠 Главное меню", callback_data=cb("main_menu", key))]
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
 
-            await query.edit_message_text(next_text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+            return next_text, reply_markup
         else:
-            await query.edit_message_text("❌ <strong>Очередь пуста!</strong>", parse_mode=ParseMode.HTML)
+            return "❌ <strong>Очередь пуста!</strong>", None
+
+    elif action == "clear":
+        if not is_admin(user.id):
+            return "❌ <strong>Эта функция доступна только преподавателю!</strong>", None
+
+        removed = await shard.actor.call('clear')
+        if removed:
+            queue_event(key, "clear", *removed)
+        keyboard = [
+            [InlineKeyboardButton("⚙️ Панель управления", callback_data=cb("admin", key))],
+            [InlineKeyboardButton("🏠 Главное меню", callback_data=cb("main_menu", key))]
+        ]
+        return (
+            f"🗑 <strong>Очередь{queue_title(key)} очищена</strong>\n\nУдалено студентов: {len(removed)}",
+            InlineKeyboardMarkup(keyboard)
+        )
 
-    elif query.data == "admin":
+    elif action == "admin":
         # Проверка прав доступа для админ-панели
         if not is_admin(user.id):
-            await query.edit_message_text(
-                "❌ <strong>У вас нет прав доступа к панели управления!</strong>",
-                parse_mode=ParseMode.HTML
-            )
-            return
+            return "❌ <strong>У вас нет прав доступа к панели управления!</strong>", None
 
-        queue = student_queue.get_queue()
-        total_students = len(queue)
+        total_students = len(shard.queue)
         
         admin_text = f"""
 ⚙️ <strong>Панель управления преподавателя</strong>
 
 📊 <strong>Статистика:</strong>
 👥 Студентов в очереди: <strong>{total_students}</strong>
-
+{service_text(key, total_students)}
 🛠️ <strong>Действия:</strong>
 • Используй кнопку "Следующий студент" для вызова
 • Просматривай очередь через кнопку "Показать очередь"
         """
 
         keyboard = [
-            [InlineKeyboardButton("✅ Следующий студент", callback_data="next")],
-            [InlineKeyboardButton("📋 Показать очередь", callback_data="queue")],
-            [InlineKeyboardButton("🔄 Обновить статистику", callback_data="admin")],
-            [InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")]
+            [InlineKeyboardButton("✅ Следующий студент", callback_data=cb("next", key))],
+            [InlineKeyboardButton("📋 Показать очередь", callback_data=cb("queue", key))],
+            [InlineKeyboardButton("🔄 Обновить статистику", callback_data=cb("admin", key))],
+            [InlineKeyboardButton("🔬 Профилирование", callback_data=cb("profile", key))],
+            [InlineKeyboardButton("🏠 Главное меню", callback_data=cb("main_menu", key))]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
 
-        await query.edit_message_text(admin_text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+        return admin_text, reply_markup
 
-    elif query.data == "help":
+    elif action == "profile":
+        if not is_admin(user.id):
+            return "❌ <strong>У вас нет прав доступа к панели управления!</strong>", None
+
+        keyboard = [[InlineKeyboardButton("⚙️ Панель управления", callback_data=cb("admin", key))]]
+        return start_profile(query.message.chat_id, PROFILE_SECONDS), InlineKeyboardMarkup(keyboard)
+
+    elif action == "help":
         help_text = """
 <strong>📖 Инструкция по использованию бота:</strong>
 
@@ -616,6 +1817,8 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 ✅ <strong>/leave</strong> - выйти из очереди (если передумал)
 ✅ <strong>/queue</strong> - посмотреть всю очередь
 ✅ <strong>/position</strong> - узнать свою позицию
+✅ <strong>/join lab3</strong> - встать в очередь конкретной лабораторной
+✅ <strong>/surname</strong> - сменить сохранённую фамилию
         """
 
         if is_admin(user.id):
@@ -623,23 +1826,31 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 <strong>Для преподавателя:</strong>
 👨‍🏫 <strong>/next</strong> - отметить, что текущий студент сдал работу
 👨‍🏫 <strong>/admin</strong> - открыть панель управления
+👨‍🏫 <strong>/board</strong> - закрепить в чате табло очереди (/board off - убрать)
+👨‍🏫 <strong>/find фамилия</strong> - найти студентов по началу фамилии, имени или username
+👨‍🏫 <strong>/remove фамилия|#позиция</strong> - убрать студента из очереди
+👨‍🏫 <strong>/move фамилия|#позиция позиция</strong> - переставить студента
+👨‍🏫 <strong>/import</strong> - загрузить список студентов (файл queue.json или фамилии по строкам)
+👨‍🏫 <strong>/clear</strong> - очистить очередь, <strong>/shuffle</strong> - перемешать её
+👨‍🏫 <strong>/export [ГГГГ-ММ-ДД [ГГГГ-ММ-ДД]] [лабораторная|all]</strong> - история очереди в CSV
+👨‍🏫 <strong>/profile [секунд] [flame]</strong> - профилирование бота с отчётом документом
             """
 
         keyboard = [
-            [InlineKeyboardButton("📝 Встать в очередь", callback_data="join")],
-            [InlineKeyboardButton("📋 Показать очередь", callback_data="queue")],
+            [InlineKeyboardButton("📝 Встать в очередь", callback_data=cb("join", key))],
+            [InlineKeyboardButton("📋 Показать очередь", callback_data=cb("queue", key))],
         ]
 
         if is_admin(user.id):
-            keyboard.append([InlineKeyboardButton("⚙️ Панель управления", callback_data="admin")])
+            keyboard.append([InlineKeyboardButton("⚙️ Панель управления", callback_data=cb("admin", key))])
 
-        keyboard.append([InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")])
+        keyboard.append([InlineKeyboardButton("🏠 Главное меню", callback_data=cb("main_menu", key))])
 
         reply_markup = InlineKeyboardMarkup(keyboard)
 
-        await query.edit_message_text(help_text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+        return help_text, reply_markup
 
-    elif query.data == "main_menu":
+    elif action == "main_menu":
         welcome_text = f"""
 <strong>Главное меню</strong>
 
@@ -649,22 +1860,151 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         """
 
         keyboard = [
-            [InlineKeyboardButton("📝 Встать в очередь", callback_data="join")],
-            [InlineKeyboardButton("❌ Покинуть очередь", callback_data="leave")],
-            [InlineKeyboardButton("📋 Показать очередь", callback_data="queue")],
-            [InlineKeyboardButton("🔍 Моя позиция", callback_data="position")],
+            [InlineKeyboardButton("📝 Встать в очередь", callback_data=cb("join", key))],
+            [InlineKeyboardButton("❌ Покинуть очередь", callback_data=cb("leave", key))],
+            [InlineKeyboardButton("📋 Показать очередь", callback_data=cb("queue", key))],
+            [InlineKeyboardButton("🔍 Моя позиция", callback_data=cb("position", key))],
         ]
 
         # Только для администратора показываем кнопки управления
         if is_admin(user.id):
-            keyboard.append([InlineKeyboardButton("✅ Следующий студент", callback_data="next")])
-            keyboard.append([InlineKeyboardButton("⚙️ Панель управления", callback_data="admin")])
+            keyboard.append([InlineKeyboardButton("✅ Следующий студент", callback_data=cb("next", key))])
+            keyboard.append([InlineKeyboardButton("⚙️ Панель управления", callback_data=cb("admin", key))])
 
-        keyboard.append([InlineKeyboardButton("ℹ️ Помощь", callback_data="help")])
+        keyboard.append([InlineKeyboardButton("ℹ️ Помощь", callback_data=cb("help", key))])
 
         reply_markup = InlineKeyboardMarkup(keyboard)
 
-        await query.edit_message_text(welcome_text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+        return welcome_text, reply_markup
+
+# Сохранение того, что живёт только в памяти, перед остановкой
+def save_state_snapshot(unsent):
+    """Диалоги, неотправленные сообщения и загруженные очереди — в STATE_SNAPSHOT_FILE"""
+    messages = [record for record in map(dump_message, unsent) if record is not None]
+    if len(messages) < len(unsent):
+        logger.warning(f"Не сохранено сообщений с файлами: {len(unsent) - len(messages)}")
+    snapshot = {
+        'saved_at': time.time(),
+        'conversations': conversations.dump(),
+        'outbox': messages,
+        # Сначала недавно использованные: при запуске они загрузятся первыми
+        'queues': [shard.key for shard in reversed(queues.loaded())],
+        # Только загруженных очередей: статистика давно выгруженных не копится от перезапуска к перезапуску
+        'service_times': {shard.key: service_times[shard.key].to_dict() for shard in queues.loaded()
+                          if shard.key in service_times and service_times[shard.key].samples},
+    }
+    tmp_path = f"{STATE_SNAPSHOT_FILE}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp_path, STATE_SNAPSHOT_FILE)
+    except (OSError, TypeError, ValueError) as e:
+        logger.error(f"Ошибка сохранения состояния перед остановкой: {e}")
+        return
+    logger.info(f"Сохранено перед остановкой: диалогов {len(snapshot['conversations'])}, сообщений {len(messages)}")
+
+# Восстановление состояния, сохранённого при прошлой остановке
+def restore_state_snapshot():
+    try:
+        with open(STATE_SNAPSHOT_FILE, encoding='utf-8') as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError) as e:
+        logger.error(f"Ошибка загрузки состояния прошлого запуска: {e}")
+        snapshot = None
+    # Снимок одноразовый: при следующем сбое старые сообщения не должны уйти повторно
+    try:
+        os.remove(STATE_SNAPSHOT_FILE)
+    except OSError:
+        pass
+    if snapshot is None:
+        return
+
+    conversations.restore(snapshot.get('conversations', ()), max(time.time() - snapshot.get('saved_at', 0), 0))
+    outbox.restore(snapshot.get('outbox', ()))
+    for key, data in snapshot.get('service_times', {}).items():
+        service_stats(key).load(data)
+    started = time.perf_counter()
+    loaded = 0
+    for key in snapshot.get('queues', ()):
+        if time.perf_counter() - started > WARM_LOAD_BUDGET:
+            break
+        queues.get(key)
+        loaded += 1
+    logger.info(f"Восстановлено после перезапуска: диалогов {len(conversations)}, "
+                f"сообщений {len(snapshot.get('outbox', ()))}, очередей загружено заранее {loaded}")
+
+# Очередь отправки работает через бота приложения
+async def on_startup(application: Application):
+    await outbox.start(application.bot)
+    restore_state_snapshot()
+    if METRICS_PORT:
+        try:
+            await metrics_server.start()
+        except OSError as e:
+            logger.error(f"Не удалось запустить сервер метрик: {e}")
+
+# Перед закрытием соединений отправляем то, что успели поставить в очередь; остальное сохраняем.
+# К этому моменту Application.stop() уже дождался всех начатых обработчиков
+async def on_stop(application: Application):
+    if profile_task is not None and not profile_task.done():
+        # Окно профилирования прерывается остановкой: отчёт уже не нужен
+        profile_task.cancel()
+        profiler.stop()
+    unsent = await outbox.stop(SHUTDOWN_DRAIN_TIMEOUT)
+    save_state_snapshot(unsent)
+
+# Запись несохранённых изменений при остановке бота
+async def on_shutdown(application: Application):
+    await metrics_server.stop()
+    await queues.close_all()
+    await profiles.close()
+    await history.close()
+    logger.info("Очередь сохранена перед остановкой")
+
+# Сборка приложения со всеми обработчиками
+def build_application(token: str, request=None, get_updates_request=None) -> Application:
+    """Приложение бота; request и get_updates_request подменяют HTTP-клиент (нагрузочный тест без сети)"""
+    builder = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+    )
+    if request is not None:
+        builder = builder.request(request)
+    if get_updates_request is not None:
+        builder = builder.get_updates_request(get_updates_request)
+    application = builder.build()
+
+    # Защита от флуда стоит перед всеми обработчиками
+    application.add_handler(TypeHandler(Update, flood_guard), group=-1)
+    application.add_handler(CommandHandler("start", instrumented(start)))
+    application.add_handler(CommandHandler("help", instrumented(help_command)))
+    application.add_handler(CommandHandler("join", instrumented(join_queue)))
+    application.add_handler(CommandHandler("leave", instrumented(leave_queue)))
+    application.add_handler(CommandHandler("surname", instrumented(surname_command)))
+    application.add_handler(CommandHandler("queue", instrumented(show_queue)))
+    application.add_handler(CommandHandler("position", instrumented(get_position)))
+    application.add_handler(CommandHandler("next", instrumented(next_student)))
+    application.add_handler(CommandHandler("find", instrumented(find_command)))
+    application.add_handler(CommandHandler("remove", instrumented(remove_command)))
+    application.add_handler(CommandHandler("move", instrumented(move_command)))
+    application.add_handler(CommandHandler("import", instrumented(import_command)))
+    application.add_handler(CommandHandler("clear", instrumented(clear_command)))
+    application.add_handler(CommandHandler("shuffle", instrumented(shuffle_command)))
+    application.add_handler(CommandHandler("export", instrumented(export_command)))
+    application.add_handler(CommandHandler("admin", instrumented(admin_panel)))
+    application.add_handler(CommandHandler("board", instrumented(board_command)))
+    application.add_handler(CommandHandler("profile", instrumented(profile_command)))
+
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, instrumented(handle_surname_input)))
+    application.add_handler(MessageHandler(filters.Document.ALL, instrumented(handle_document)))
+    application.add_handler(CallbackQueryHandler(instrumented(button_handler)))
+    return application
 
 # Главная функция
 def main():
@@ -675,22 +2015,18 @@ def main():
         return
 
     try:
-        application = Application.builder().token(TOKEN).build()
-
-        application.add_handler(CommandHandler("start", start))
-        application.add_handler(CommandHandler("help", help_command))
-        application.add_handler(CommandHandler("join", join_queue))
-        application.add_handler(CommandHandler("leave", leave_queue))
-        application.add_handler(CommandHandler("queue", show_queue))
-        application.add_handler(CommandHandler("position", get_position))
-        application.add_handler(CommandHandler("next", next_student))
-        application.add_handler(CommandHandler("admin", admin_panel))
-
-        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_surname_input))
-        application.add_handler(CallbackQueryHandler(button_handler))
-
-        logger.info("🚀 Бот запущен на Railway...")
-        application.run_polling()
+        application = build_application(TOKEN)
+
+        if BOT_MODE == "webhook":
+            if not WEBHOOK_SECRET:
+                logger.error("❌ Ошибка: для режима webhook нужен WEBHOOK_SECRET!")
+                return
+            receiver = WebhookReceiver(application, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET)
+            logger.info(f"🚀 Бот запущен на Railway (webhook {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH})...")
+            asyncio.run(serve_webhook(application, receiver, WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH if WEBHOOK_URL else None))
+        else:
+            logger.info("🚀 Бот запущен на Railway...")
+            application.run_polling()
         
     except Exception as e:
         logger.error(f"❌ Критическая ошибка: {e}")
@@ -0,0 +1,284 @@
+"""Общая очередь исходящих запросов к Telegram"""
+import asyncio
+import heapq
+import itertools
+import logging
+from collections import deque
+
+import telegram
+from telegram import TelegramObject
+from telegram.constants import ChatType
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты: меньше — раньше
+PRIORITY_HIGH = 0    # ответы преподавателю
+PRIORITY_NORMAL = 1  # ответы студентам и табло
+PRIORITY_BULK = 2    # массовые уведомления
+
+
+class OutboxFull(Exception):
+    """Сообщение не поставлено в очередь отправки: она переполнена"""
+
+
+class OutboundMessage:
+    """Один вызов метода бота; method и kwargs — имя метода и его аргументы"""
+
+    __slots__ = ('chat_id', 'method', 'kwargs', 'priority', 'seq', 'future')
+
+    def __init__(self, chat_id, method: str, kwargs: dict, priority: int, seq: int, future):
+        self.chat_id = chat_id
+        self.method = method
+        self.kwargs = kwargs
+        self.priority = priority
+        self.seq = seq
+        self.future = future
+
+
+def _consume(future):
+    # Ошибку уже записали в лог; отправитель может и не ждать результата
+    if not future.cancelled():
+        future.exception()
+
+
+def dump_message(message: OutboundMessage):
+    """Неотправленное сообщение в виде для JSON; None, если его аргументы не сохранить (например, файл)"""
+    kwargs = {}
+    for name, value in message.kwargs.items():
+        if isinstance(value, TelegramObject):
+            # Клавиатуры и прочие объекты Bot API сохраняются словарём и восстанавливаются через de_json
+            value = {'__telegram__': type(value).__name__, 'data': value.to_dict()}
+        elif value is not None and not isinstance(value, (str, int, float, bool)):
+            return None
+        kwargs[name] = value
+    return {'chat_id': message.chat_id, 'method': message.method, 'priority': message.priority, 'kwargs': kwargs}
+
+
+class Outbox:
+    """Все отправки бота проходят через эту очередь.
+
+    Сообщения одного чата уходят строго по порядку и по одному, разные чаты
+    обслуживаются параллельно пулом из workers задач: первым берётся чат,
+    чьё очередное сообщение важнее. Лимиты Telegram соблюдаются через limiter,
+    на RetryAfter сообщение ждёт указанное время и повторяется. Очередь
+    ограничена max_size сообщениями: при переполнении отбрасываются самые
+    новые сообщения наименьшего приоритета.
+    """
+
+    def __init__(self, limiter, workers: int = 8, max_size: int = 1000,
+                 max_retries: int = 3, backoff: float = 1.0):
+        self.limiter = limiter
+        self.workers = workers
+        self.max_size = max_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.bot = None
+        # chat_id -> сообщения чата по порядку; первое может быть уже в отправке
+        self._lanes = {}
+        # (приоритет, номер, chat_id) для чатов, у которых есть что отправить
+        self._ready = []
+        self._busy = set()
+        # Сообщения, запрос которых прямо сейчас выполняется в Bot API
+        self._sending = set()
+        self._size = 0
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks = []
+        self.stats = {'queued': 0, 'sent': 0, 'retried': 0, 'dropped': 0, 'failed': 0}
+        # Ошибки Bot API по типам: RetryAfter, TimedOut, BadRequest...
+        self.errors = {}
+
+    def __len__(self):
+        return self._size
+
+    def submit(self, chat_id, method: str, priority: int = PRIORITY_NORMAL, /, **kwargs) -> asyncio.Future:
+        """Поставить вызов bot.<method>(**kwargs) в очередь чата chat_id.
+
+        Возвращает future с результатом вызова; ждать его не обязательно.
+        """
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_consume)
+        message = OutboundMessage(chat_id, method, kwargs, priority, next(self._seq), future)
+
+        if self._size >= self.max_size and not self._make_room(message):
+            self.stats['dropped'] += 1
+            logger.warning(f"Очередь отправки переполнена, сообщение в чат {chat_id} отброшено")
+            future.set_exception(OutboxFull(method))
+            return future
+
+        lane = self._lanes.setdefault(chat_id, deque())
+        lane.append(message)
+        self._size += 1
+        self.stats['queued'] += 1
+        self._idle.clear()
+        if len(lane) == 1 and chat_id not in self._busy:
+            self._push(chat_id, message)
+        return future
+
+    def send(self, chat_id, text: str, priority: int = PRIORITY_NORMAL, **kwargs) -> asyncio.Future:
+        """Новое сообщение в чат"""
+        return self.submit(chat_id, 'send_message', priority, chat_id=chat_id, text=text, **kwargs)
+
+    def reply(self, message, text: str, priority: int = PRIORITY_NORMAL, **kwargs) -> asyncio.Future:
+        """Ответ на сообщение; в группах — с цитатой, как у Message.reply_text"""
+        if message.chat.type != ChatType.PRIVATE:
+            kwargs.setdefault('reply_to_message_id', message.message_id)
+        return self.send(message.chat_id, text, priority, **kwargs)
+
+    def edit(self, message, text: str, priority: int = PRIORITY_NORMAL, **kwargs) -> asyncio.Future:
+        """Замена текста сообщения бота"""
+        return self.submit(
+            message.chat_id, 'edit_message_text', priority,
+            chat_id=message.chat_id, message_id=message.message_id, text=text, **kwargs
+        )
+
+    def _push(self, chat_id, message):
+        heapq.heappush(self._ready, (message.priority, message.seq, chat_id))
+        self._wakeup.set()
+
+    def _make_room(self, message) -> bool:
+        """Вытеснить самое новое сообщение, менее важное, чем message"""
+        victim = None
+        for chat_id, lane in self._lanes.items():
+            # Первое сообщение чата, который сейчас отправляется, уже в работе
+            candidates = list(lane)[1:] if chat_id in self._busy else lane
+            for queued in candidates:
+                if queued.priority > message.priority and (
+                        victim is None or (queued.priority, queued.seq) > (victim.priority, victim.seq)):
+                    victim = queued
+        if victim is None:
+            return False
+
+        lane = self._lanes[victim.chat_id]
+        lane.remove(victim)
+        if not lane:
+            # Запись чата в _ready станет пустой и будет пропущена
+            del self._lanes[victim.chat_id]
+        self._size -= 1
+        self.stats['dropped'] += 1
+        logger.warning(f"Очередь отправки переполнена, вытеснено сообщение в чат {victim.chat_id}")
+        victim.future.set_exception(OutboxFull(victim.method))
+        return True
+
+    async def start(self, bot):
+        """Запуск задач отправки"""
+        self.bot = bot
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def drain(self):
+        """Дождаться отправки всех поставленных сообщений"""
+        await self._idle.wait()
+
+    async def stop(self, timeout: float = 10.0):
+        """Дождаться отправки очереди (не дольше timeout секунд) и остановить задачи.
+
+        Возвращает неотправленные сообщения по порядку постановки — все, кроме тех,
+        чей запрос уже ушёл в Bot API: их повтор после перезапуска мог бы задвоить сообщение.
+        """
+        try:
+            await asyncio.wait_for(self.drain(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не отправлено сообщений при остановке: {self._size}")
+        # Ждущие лимита или паузы RetryAfter ещё не отправлены, их можно повторить
+        unsent = sorted((message for lane in self._lanes.values() for message in lane
+                         if message not in self._sending), key=lambda message: message.seq)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for message in unsent:
+            message.future.cancel()
+        self._lanes.clear()
+        self._ready.clear()
+        self._size = 0
+        self._idle.set()
+        return unsent
+
+    def restore(self, records):
+        """Поставить в очередь сообщения, сохранённые dump_message перед перезапуском"""
+        for record in records:
+            kwargs = {}
+            for name, value in record['kwargs'].items():
+                if isinstance(value, dict) and '__telegram__' in value:
+                    value = getattr(telegram, value['__telegram__']).de_json(value['data'], self.bot)
+                kwargs[name] = value
+            self.submit(record['chat_id'], record['method'], record['priority'], **kwargs)
+
+    async def _worker(self):
+        while True:
+            while not self._ready:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            _, _, chat_id = heapq.heappop(self._ready)
+            lane = self._lanes.get(chat_id)
+            # Устаревшая запись: чат уже отправляется другой задачей или его очередь опустела
+            if not lane or chat_id in self._busy:
+                continue
+
+            self._busy.add(chat_id)
+            message = lane[0]
+            try:
+                await self._deliver(message)
+            finally:
+                self._busy.discard(chat_id)
+                lane.popleft()
+                self._size -= 1
+                if lane:
+                    self._push(chat_id, lane[0])
+                else:
+                    del self._lanes[chat_id]
+                if not self._size:
+                    self._idle.set()
+
+    async def _deliver(self, message):
+        """Отправка одного сообщения с повторами"""
+        for attempt in range(self.max_retries + 1):
+            if message.future.done():
+                return
+            await self.limiter.acquire(message.chat_id)
+            retry = False
+            self._sending.add(message)
+            try:
+                result = await getattr(self.bot, message.method)(**message.kwargs)
+                error = None
+            except RetryAfter as e:
+                delay = e.retry_after
+                delay = delay.total_seconds() if hasattr(delay, 'total_seconds') else delay
+                logger.warning(f"Flood control в чате {message.chat_id}, повтор через {delay} с")
+                error, retry = e, True
+            except BadRequest as e:
+                if "not modified" in str(e):
+                    # Сообщение уже выглядит так, как нужно
+                    result, error = None, None
+                else:
+                    # Повтор не поможет: запрос некорректен
+                    error = e
+            except NetworkError as e:
+                delay = self.backoff * 2 ** attempt
+                error, retry = e, True
+            except Exception as e:
+                error = e
+            finally:
+                self._sending.discard(message)
+
+            if error is None:
+                self.stats['sent'] += 1
+                if not message.future.done():
+                    message.future.set_result(result)
+                return
+
+            name = type(error).__name__
+            self.errors[name] = self.errors.get(name, 0) + 1
+            if not retry or attempt == self.max_retries:
+                break
+            self.stats['retried'] += 1
+            await asyncio.sleep(delay)
+
+        self.stats['failed'] += 1
+        logger.error(f"Не удалось выполнить {message.method} в чате {message.chat_id}: {error}")
+        if not message.future.done():
+            message.future.set_exception(error)
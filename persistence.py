@@ -0,0 +1,97 @@
+"""Фоновая запись очереди на диск"""
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from storage import StaleVersion
+
+logger = logging.getLogger(__name__)
+
+WRITE_SECONDS = metrics.histogram('queue_bot_persist_write_seconds', "Время записи пачки изменений очереди")
+
+
+class PersistenceWorker:
+    """Копит изменения очередей и сбрасывает их на диск пачками в отдельном потоке.
+
+    Изменение попадает на диск не позже чем через max_delay секунд, а все
+    изменения, накопившиеся за это окно, записываются одной операцией.
+    """
+
+    def __init__(self, max_delay: float = 0.2):
+        self.max_delay = max_delay
+        # Один поток: записи одной очереди выполняются строго по порядку
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="persistence")
+        self._dirty = {}
+        self._timer = None
+        self._inflight = set()
+        # Сколько записей каждой очереди сейчас выполняется в потоке
+        self._writing = {}
+
+    def schedule(self, queue):
+        """Пометить очередь как изменённую"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Вне event loop (скрипты, миграции) пишем сразу
+            queue.write_pending()
+            return
+
+        self._dirty[id(queue)] = queue
+        if self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush_dirty)
+
+    def _flush_dirty(self):
+        """Отправка накопленных изменений в поток записи"""
+        self._timer = None
+        loop = asyncio.get_running_loop()
+        dirty, self._dirty = self._dirty, {}
+        for queue in dirty.values():
+            # Снимок берётся в потоке event loop, пока очередь никто не меняет
+            batch = queue.take_pending()
+            future = loop.run_in_executor(self._executor, self._write, queue, batch)
+            self._inflight.add(future)
+            self._writing[id(queue)] = self._writing.get(id(queue), 0) + 1
+            future.add_done_callback(lambda f, queue=queue, records=batch[0]: self._on_written(f, queue, records))
+
+    @staticmethod
+    def _write(queue, batch):
+        """Запись пачки в потоке записи с замером времени"""
+        started = time.perf_counter()
+        try:
+            queue.write_batch(*batch)
+        finally:
+            WRITE_SECONDS.observe(time.perf_counter() - started)
+
+    def _on_written(self, future, queue, records):
+        queue_id = id(queue)
+        self._inflight.discard(future)
+        self._writing[queue_id] -= 1
+        if not self._writing[queue_id]:
+            del self._writing[queue_id]
+        if future.cancelled():
+            return
+        if isinstance(future.exception(), StaleVersion):
+            # Очередь записал другой экземпляр бота: очередь перечитается, изменения повторятся поверх
+            queue.reject(records)
+        elif future.exception():
+            logger.error(f"Ошибка фоновой записи очереди: {future.exception()}")
+
+    def is_dirty(self, queue) -> bool:
+        """Есть ли у очереди изменения, ещё не записанные на диск"""
+        return id(queue) in self._dirty or id(queue) in self._writing
+
+    def is_writing(self, queue) -> bool:
+        """Записываются ли сейчас пачки очереди в потоке записи"""
+        return id(queue) in self._writing
+
+    async def flush(self):
+        """Немедленная запись всех накопленных изменений (например, при остановке бота)"""
+        # Отклонённые пачки после перечитывания очереди ставятся на запись снова
+        while self._dirty or self._inflight:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._flush_dirty()
+            if self._inflight:
+                await asyncio.gather(*self._inflight, return_exceptions=True)
@@ -0,0 +1,142 @@
+"""Сэмплирующий профилировщик потока event loop, включаемый по команде"""
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+
+# Функции, в которых event loop ждёт новых событий: такие сэмплы — простой, а не работа
+IDLE_FUNCTIONS = {'select', 'poll', 'epoll', 'kqueue', 'control'}
+
+
+def _frame_name(code) -> str:
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{code.co_firstlineno}"
+
+
+class ProfileResult:
+    """Собранные стеки: (код корня, ..., код листа) -> число сэмплов.
+
+    cpu — сэмплы сняты по таймеру процессорного времени, и простой в них не попадает.
+    """
+
+    def __init__(self, stacks: Counter, samples: int, duration: float, interval: float, cpu: bool):
+        self.stacks = stacks
+        self.samples = samples
+        self.duration = duration
+        self.interval = interval
+        self.cpu = cpu
+
+    def idle_samples(self) -> int:
+        return sum(count for stack, count in self.stacks.items() if stack and stack[-1].co_name in IDLE_FUNCTIONS)
+
+    def report(self, top: int = 30) -> str:
+        """Топ функций по собственному и полному времени"""
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            if not stack:
+                continue
+            own[stack[-1]] += count
+            # Рекурсивная функция учитывается в стеке один раз
+            for code in set(stack):
+                total[code] += count
+
+        samples = max(self.samples, 1)
+        if self.cpu:
+            cpu_time = self.samples * self.interval
+            summary = (f"сэмплов процессорного времени {self.samples} по {self.interval * 1000:.0f} мс, "
+                       f"CPU {cpu_time:.1f} с ({100 * cpu_time / max(self.duration, 1e-9):.0f}% окна)")
+        else:
+            idle = self.idle_samples()
+            summary = (f"сэмплов {self.samples}, ожидание событий {100 * idle / samples:.1f}%, "
+                       f"работа {100 * (samples - idle) / samples:.1f}%")
+        lines = [f"Профиль за {self.duration:.1f} с: {summary}"]
+        for title, counts in (("Собственное время", own), ("Время вместе с вызовами", total)):
+            lines.append("")
+            lines.append(f"{title}:")
+            lines.append(f"{'сэмплы':>8} {'%':>6}  функция")
+            for code, count in counts.most_common(top):
+                lines.append(f"{count:>8} {100 * count / samples:>6.1f}  {_frame_name(code)}")
+        return "\n".join(lines) + "\n"
+
+    def collapsed(self) -> str:
+        """Стеки в формате collapsed stacks (flamegraph.pl, speedscope)"""
+        return "".join(
+            ";".join(_frame_name(code) for code in stack) + f" {count}\n"
+            for stack, count in self.stacks.most_common()
+            if stack
+        )
+
+
+class SamplingProfiler:
+    """Снимает стек потока event loop каждые interval секунд.
+
+    В главном потоке на Unix сэмплы снимает обработчик SIGPROF по таймеру
+    процессорного времени: он выполняется в самом потоке loop и видит точный
+    стек. Иначе стек читает отдельный поток через sys._current_frames(); такие
+    сэмплы смещены к моментам, когда loop отпускает GIL.
+
+    Пока профилирование выключено, нет ни таймера, ни потока, и обработка
+    обновлений не платит ничего; во время окна — один обход стека на сэмпл.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self._thread = None
+        self._stop = None
+        self._previous_handler = None
+        self._stacks = None
+        self._samples = 0
+        self._started = None
+        self._cpu = False
+
+    @property
+    def running(self) -> bool:
+        return self._started is not None
+
+    def start(self):
+        """Начать профилирование потока, из которого вызван метод (потока event loop)"""
+        if self.running:
+            raise RuntimeError("Профилирование уже запущено")
+
+        self._stacks = Counter()
+        self._samples = 0
+        self._started = time.monotonic()
+        self._cpu = hasattr(signal, 'setitimer') and threading.current_thread() is threading.main_thread()
+        if self._cpu:
+            self._previous_handler = signal.signal(signal.SIGPROF, self._on_signal)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        else:
+            self._stop = threading.Event()
+            self._thread = threading.Thread(
+                target=self._sample_thread, args=(threading.get_ident(), self._stop), name="profiler", daemon=True
+            )
+            self._thread.start()
+
+    def _record(self, frame):
+        stack = []
+        while frame is not None:
+            stack.append(frame.f_code)
+            frame = frame.f_back
+        self._stacks[tuple(reversed(stack))] += 1
+        self._samples += 1
+
+    def _on_signal(self, signum, frame):
+        self._record(frame)
+
+    def _sample_thread(self, target: int, stop: threading.Event):
+        while not stop.wait(self.interval):
+            self._record(sys._current_frames().get(target))
+
+    def stop(self) -> ProfileResult:
+        """Остановить профилирование и вернуть собранные стеки"""
+        if self._cpu:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, self._previous_handler)
+        else:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        duration = time.monotonic() - self._started
+        self._started = None
+        return ProfileResult(self._stacks, self._samples, duration, self.interval, self._cpu)
@@ -0,0 +1,84 @@
+"""Профили студентов: сохранённая фамилия, чтобы не спрашивать её при каждой записи"""
+import asyncio
+import logging
+import sqlite3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Отметка в кэше: профиля нет (чтобы не ходить в базу за каждым новым студентом)
+_MISSING = object()
+
+
+class ProfileStore:
+    """Профили по user_id в отдельной базе SQLite.
+
+    База открывается при первом обращении, запросы к ней выполняются в своём
+    потоке. В памяти держится не больше max_cached последних профилей, включая
+    отметки об их отсутствии, поэтому размер процесса не зависит от числа студентов.
+    """
+
+    def __init__(self, filename: str, max_cached: int = 10000):
+        self.filename = filename
+        self.max_cached = max_cached
+        self._cache = OrderedDict()
+        self._conn = None
+        # Один поток: соединение SQLite используется только из него
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="profiles")
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.filename, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS profiles (user_id INTEGER PRIMARY KEY, surname TEXT)")
+        return self._conn
+
+    def _select(self, user_id: int):
+        row = self._connect().execute("SELECT surname FROM profiles WHERE user_id = ?", (user_id,)).fetchone()
+        return {'user_id': user_id, 'surname': row[0]} if row else None
+
+    def _upsert(self, user_id: int, surname: str):
+        self._connect().execute(
+            "INSERT INTO profiles (user_id, surname) VALUES (?, ?) "
+            "ON CONFLICT (user_id) DO UPDATE SET surname = excluded.surname",
+            (user_id, surname)
+        )
+
+    def _remember(self, user_id: int, profile):
+        self._cache[user_id] = profile if profile is not None else _MISSING
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+
+    async def get(self, user_id: int):
+        """Профиль студента или None"""
+        profile = self._cache.get(user_id)
+        if profile is not None:
+            self._cache.move_to_end(user_id)
+            return None if profile is _MISSING else profile
+        try:
+            profile = await asyncio.get_running_loop().run_in_executor(self._executor, self._select, user_id)
+        except Exception as e:
+            logger.error(f"Ошибка чтения профиля {user_id}: {e}")
+            return None
+        self._remember(user_id, profile)
+        return profile
+
+    async def set_surname(self, user_id: int, surname: str):
+        """Сохранение фамилии студента"""
+        self._remember(user_id, {'user_id': user_id, 'surname': surname})
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._upsert, user_id, surname)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения профиля {user_id}: {e}")
+
+    async def close(self):
+        """Дождаться записей и закрыть базу, не блокируя event loop"""
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._close)
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,70 @@
+"""Последовательное выполнение изменений очереди при параллельной обработке обновлений"""
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class QueueActor:
+    """Единственный писатель очереди.
+
+    Все изменяющие вызовы проходят через один канал команд и выполняются
+    строго по одному в порядке поступления. Чтение очереди и сетевые запросы
+    обработчиков при этом идут параллельно. Перед каждой командой очередь
+    подтягивает изменения, сделанные другими экземплярами бота.
+    """
+
+    def __init__(self, queue):
+        self.queue = queue
+        self._commands = None
+        self._task = None
+        self._unfinished = 0
+
+    def _ensure_running(self):
+        # Канал и задача создаются лениво внутри работающего event loop
+        if self._task is None or self._task.done():
+            self._commands = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def call(self, method: str, *args):
+        """Выполнить метод очереди в порядке общей очереди команд и вернуть результат"""
+        self._ensure_running()
+        future = asyncio.get_running_loop().create_future()
+        self._unfinished += 1
+        self._commands.put_nowait((method, args, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            method, args, future = await self._commands.get()
+            try:
+                if not future.cancelled():
+                    self.queue.sync()
+                    future.set_result(getattr(self.queue, method)(*args))
+            except Exception as e:
+                logger.error(f"Ошибка выполнения команды очереди {method}: {e}")
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self._unfinished -= 1
+                self._commands.task_done()
+
+    def is_idle(self) -> bool:
+        """Нет ли невыполненных команд"""
+        return self._unfinished == 0
+
+    async def drain(self):
+        """Дождаться выполнения всех поставленных команд"""
+        if self._task is not None and not self._task.done():
+            await self._commands.join()
+
+    def close(self):
+        """Остановка задачи актора; вызывается, когда команд больше нет"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def stop(self):
+        """Остановка после выполнения всех команд"""
+        await self.drain()
+        self.close()
@@ -0,0 +1,157 @@
+"""Индексы для быстрой работы с очередью студентов"""
+from bisect import bisect_left, insort
+
+
+class FenwickTree:
+    """Дерево Фенвика над порядковыми номерами записей очереди.
+
+    В ячейке i хранится 1, если запись с номером i ещё в очереди, и 0, если
+    она удалена. Префиксная сумма до номера записи — её позиция в очереди.
+    """
+
+    def __init__(self, size: int = 0):
+        self.size = size
+        self.tree = [0] * (size + 1)
+
+    @classmethod
+    def from_ones(cls, count: int, size: int):
+        """Построение дерева, где первые count ячеек заняты, за O(size)"""
+        fenwick = cls(size)
+        tree = fenwick.tree
+        for i in range(1, count + 1):
+            tree[i] += 1
+        for i in range(1, size + 1):
+            parent = i + (i & -i)
+            if parent <= size:
+                tree[parent] += tree[i]
+        return fenwick
+
+    def add(self, i: int, delta: int):
+        """Изменение значения ячейки i (нумерация с 1)"""
+        tree = self.tree
+        size = self.size
+        while i <= size:
+            tree[i] += delta
+            i += i & -i
+
+    def prefix_sum(self, i: int) -> int:
+        """Сумма значений в ячейках 1..i"""
+        tree = self.tree
+        total = 0
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+    def find_kth(self, k: int) -> int:
+        """Наименьший номер ячейки, префиксная сумма до которой равна k"""
+        tree = self.tree
+        pos = 0
+        step = 1 << self.size.bit_length()
+        while step:
+            nxt = pos + step
+            if nxt <= self.size and tree[nxt] < k:
+                pos = nxt
+                k -= tree[nxt]
+            step >>= 1
+        return pos + 1
+
+
+class PrefixIndex:
+    """Регистронезависимый поиск записей очереди по началу слова.
+
+    Слово -> номера записей и отсортированный список различных слов. У слова
+    одной записи (username, редкая фамилия) номер хранится числом, множество
+    заводится только для повторяющихся слов.
+    Поиск по префиксу — бинарный поиск начала диапазона слов за O(log n) и
+    проход по совпавшим словам. Новые слова сначала попадают в короткий
+    отсортированный список и сливаются с основным, когда их становится больше
+    merge_every и восьмой части основного; исчезнувшие остаются в списке до
+    слияния. Так изменение очереди стоит O(1) в среднем, а не сдвига длинного списка.
+    """
+
+    def __init__(self, merge_every: int = 512):
+        self.merge_every = merge_every
+        self._seqs = {}
+        self._words = []
+        self._recent = []
+
+    def __len__(self):
+        return len(self._seqs)
+
+    @staticmethod
+    def words(fields) -> set:
+        """Слова полей записи в нижнем регистре (username без @)"""
+        return set(" ".join(str(field) for field in fields if field).replace('@', ' ').casefold().split())
+
+    def build(self, items):
+        """Построение индекса по парам (номер записи, поля) за O(n log n)"""
+        self._seqs = {}
+        for seq, fields in items:
+            for word in self.words(fields):
+                self._link(word, seq)
+        self._words = sorted(self._seqs)
+        self._recent = []
+
+    def _link(self, word: str, seq: int) -> bool:
+        """Привязка номера к слову; True, если слово новое"""
+        seqs = self._seqs.get(word)
+        if seqs is None:
+            self._seqs[word] = seq
+            return True
+        if type(seqs) is int:
+            if seqs != seq:
+                self._seqs[word] = {seqs, seq}
+        else:
+            seqs.add(seq)
+        return False
+
+    def add(self, seq: int, fields):
+        for word in self.words(fields):
+            if self._link(word, seq):
+                insort(self._recent, word)
+        if len(self._recent) > max(self.merge_every, len(self._words) >> 3):
+            self._merge()
+
+    def remove(self, seq: int, fields):
+        for word in self.words(fields):
+            seqs = self._seqs.get(word)
+            if seqs is None:
+                continue
+            if type(seqs) is int:
+                if seqs == seq:
+                    del self._seqs[word]
+            else:
+                seqs.discard(seq)
+                if len(seqs) == 1:
+                    self._seqs[word] = seqs.pop()
+
+    def _merge(self):
+        """Слияние новых слов с основным списком за O(n) с удалением исчезнувших и повторов"""
+        # Два уже отсортированных отрезка: sorted сливает их за линейное время
+        merged = dict.fromkeys(sorted(self._words + self._recent))
+        self._words = [word for word in merged if word in self._seqs]
+        self._recent = []
+
+    def _prefix(self, prefix: str) -> set:
+        found = set()
+        for words in (self._words, self._recent):
+            i = bisect_left(words, prefix)
+            while i < len(words) and words[i].startswith(prefix):
+                seqs = self._seqs.get(words[i])
+                if type(seqs) is int:
+                    found.add(seqs)
+                elif seqs:
+                    found |= seqs
+                i += 1
+        return found
+
+    def search(self, query: str) -> list:
+        """Номера записей по возрастанию, где каждое слово query — начало какого-то слова записи"""
+        found = None
+        for prefix in self.words((query,)):
+            matches = self._prefix(prefix)
+            found = matches if found is None else found & matches
+            if not found:
+                return []
+        return sorted(found) if found else []
@@ -0,0 +1,87 @@
+"""Набор независимых очередей (по чатам и лабораторным)"""
+import logging
+import time
+from collections import OrderedDict
+
+from queue_actor import QueueActor
+
+logger = logging.getLogger(__name__)
+
+
+class QueueShard:
+    """Очередь вместе со своим актором"""
+
+    def __init__(self, key: str, queue):
+        self.key = key
+        self.queue = queue
+        self.actor = QueueActor(queue)
+        # Кэш отрисованных сообщений; действителен, пока не изменилась версия очереди
+        self.views = {}
+        self.views_version = None
+        self.last_used = time.monotonic()
+
+
+class QueueRegistry:
+    """Лениво загружает очереди по ключу и выгружает из памяти давно не используемые.
+
+    Каждая очередь хранится в своём файле и имеет собственного актора, поэтому
+    изменения одной очереди не блокируют и не переписывают другие.
+    on_evict(key) вызывается при выгрузке очереди, чтобы освободить связанные с ней данные.
+    """
+
+    def __init__(self, open_queue, writer, max_loaded: int = 100, idle_ttl: float = 600, on_evict=None):
+        self._open_queue = open_queue
+        self._on_evict = on_evict
+        self.writer = writer
+        self.max_loaded = max_loaded
+        self.idle_ttl = idle_ttl
+        self._shards = OrderedDict()
+
+    def get(self, key: str) -> QueueShard:
+        """Очередь по ключу; при необходимости загружается из хранилища"""
+        shard = self._shards.get(key)
+        if shard is None:
+            shard = QueueShard(key, self._open_queue(key))
+            self._shards[key] = shard
+            logger.info(f"Загружена очередь {key}: {len(shard.queue)} студентов")
+        else:
+            self._shards.move_to_end(key)
+        shard.last_used = time.monotonic()
+        self._evict()
+        return shard
+
+    def loaded(self):
+        """Загруженные сейчас очереди"""
+        return list(self._shards.values())
+
+    def _evict(self):
+        """Выгрузка простаивающих очередей, начиная с давно не использованных"""
+        now = time.monotonic()
+        # Последняя очередь только что запрошена, её не трогаем
+        for key, shard in list(self._shards.items())[:-1]:
+            overflow = len(self._shards) > self.max_loaded
+            if not overflow and now - shard.last_used < self.idle_ttl:
+                break
+            # Очередь с незаписанными изменениями или командами выгрузим в другой раз
+            if self.writer.is_dirty(shard.queue) or not shard.actor.is_idle():
+                continue
+            del self._shards[key]
+            shard.actor.close()
+            shard.queue.storage.close()
+            if self._on_evict is not None:
+                self._on_evict(key)
+            logger.info(f"Очередь {key} выгружена из памяти")
+
+    async def close_all(self):
+        """Остановка акторов и запись всех изменений"""
+        for shard in self._shards.values():
+            await shard.actor.stop()
+        await self.writer.flush()
+        # Журналы сворачиваются в снимки, чтобы следующий запуск не применял их построчно
+        for shard in self._shards.values():
+            if shard.queue.storage.backlog():
+                shard.queue.save_queue()
+        await self.writer.flush()
+        for shard in self._shards.values():
+            shard.queue.storage.close()
+        self._shards.clear()
@@ -0,0 +1,77 @@
+"""Ограничение частоты действий (алгоритм ведра токенов)"""
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class TokenBucket:
+    """Ведро токенов: пополняется на rate токенов в секунду, вмещает не больше capacity"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Взять токены, если они есть; не ждёт"""
+        self._refill()
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def delay(self, tokens: float = 1.0) -> float:
+        """Сколько секунд ждать, пока накопится нужное число токенов"""
+        self._refill()
+        return max(0.0, (tokens - self.tokens) / self.rate)
+
+    async def acquire(self, tokens: float = 1.0):
+        """Дождаться и взять токены"""
+        while not self.try_acquire(tokens):
+            await asyncio.sleep(self.delay(tokens))
+
+
+class KeyedBuckets:
+    """Отдельное ведро на каждый ключ.
+
+    Хранится не больше max_keys вёдер: давно не использованные вытесняются,
+    поэтому память не растёт с числом разных ключей.
+    """
+
+    def __init__(self, rate: float, capacity: float = None, max_keys: int = 10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    def get(self, key) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.capacity)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class SendLimiter:
+    """Лимиты Telegram на отправку сообщений: общий на бота и отдельный на каждый чат"""
+
+    def __init__(self, global_rate: float = 30, per_chat_rate: float = 1, per_chat_burst: float = None):
+        self.global_bucket = TokenBucket(global_rate)
+        # Короткая серия ответов в один чат (команда и ввод фамилии) уходит без задержки
+        self.per_chat = KeyedBuckets(per_chat_rate, per_chat_burst)
+
+    async def acquire(self, chat_id):
+        await self.per_chat.get(chat_id).acquire()
+        await self.global_bucket.acquire()
@@ -0,0 +1,158 @@
+"""Статистика времени сдачи: интервалы между вызовами следующего студента"""
+import math
+
+
+class QuantileSketch:
+    """Гистограмма с логарифмическими корзинами (как DDSketch) для квантилей.
+
+    Квантиль вычисляется с относительной ошибкой не больше accuracy. Корзин
+    не больше max_buckets — при переполнении сливаются две самые нижние,
+    поэтому память не зависит от числа наблюдений. Скетчи с одинаковой
+    точностью складываются корзина к корзине (merge).
+    """
+
+    def __init__(self, accuracy: float = 0.05, max_buckets: int = 128):
+        self.accuracy = accuracy
+        self.max_buckets = max_buckets
+        self._gamma = (1 + accuracy) / (1 - accuracy)
+        self._log_gamma = math.log(self._gamma)
+        # Номер корзины -> вес; корзина i содержит значения из (gamma^(i-1), gamma^i]
+        self.buckets = {}
+        self.count = 0.0
+
+    def add(self, value: float, weight: float = 1.0):
+        """Добавление наблюдения value (> 0)"""
+        index = math.ceil(math.log(max(value, 1e-9)) / self._log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0.0) + weight
+        self.count += weight
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+
+    def _collapse(self):
+        # Страдает точность только самых коротких интервалов, важных для оценки меньше всего
+        lowest, second = sorted(self.buckets)[:2]
+        self.buckets[second] += self.buckets.pop(lowest)
+
+    def quantile(self, q: float):
+        """Значение, меньше которого доля q наблюдений; None, если наблюдений нет"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        total = 0.0
+        for index in sorted(self.buckets):
+            total += self.buckets[index]
+            if total >= rank:
+                break
+        # Середина корзины с точки зрения относительной ошибки
+        return 2 * self._gamma ** index / (self._gamma + 1)
+
+    def scale(self, factor: float):
+        """Умножение весов всех наблюдений на factor (старые наблюдения забываются)"""
+        for index in self.buckets:
+            self.buckets[index] *= factor
+        self.count *= factor
+
+    def merge(self, other: 'QuantileSketch'):
+        """Добавление наблюдений другого скетча с той же точностью"""
+        if other.accuracy != self.accuracy:
+            raise ValueError("Скетчи с разной точностью не складываются")
+        for index, weight in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0.0) + weight
+        self.count += other.count
+        while len(self.buckets) > self.max_buckets:
+            self._collapse()
+
+    def to_dict(self) -> dict:
+        return {'accuracy': self.accuracy, 'buckets': {str(index): weight for index, weight in self.buckets.items()}}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        sketch = cls(data['accuracy'])
+        for index, weight in data['buckets'].items():
+            sketch.buckets[int(index)] = weight
+            sketch.count += weight
+        return sketch
+
+
+class ServiceTimes:
+    """Сколько времени уходит на одного студента в очереди.
+
+    Наблюдение — интервал между двумя вызовами /next, если очередь между ними
+    не пустела и перерыв не длиннее max_gap. По наблюдениям ведутся
+    экспоненциально взвешенное среднее (вес нового — alpha) и скетч квантилей.
+    Когда вес скетча превышает 2 * window, он уменьшается вдвое: скетч
+    следит за последними примерно window сдачами. Всё обновляется за O(1).
+    """
+
+    def __init__(self, alpha: float = 0.2, window: int = 200, max_gap: float = 1800, min_samples: int = 3):
+        self.alpha = alpha
+        self.window = window
+        self.max_gap = max_gap
+        self.min_samples = min_samples
+        self.mean = None
+        self.samples = 0
+        self.sketch = QuantileSketch()
+        # Время последнего /next, после которого в очереди кто-то остался
+        self.last = None
+
+    def next_called(self, now: float, remaining: int):
+        """Учёт вызова следующего студента; remaining — сколько осталось в очереди"""
+        if self.last is not None and 0 < now - self.last <= self.max_gap:
+            self.observe(now - self.last)
+        self.last = now if remaining else None
+
+    def pause(self):
+        """Очередь очищена или перемешана: следующий интервал не считается"""
+        self.last = None
+
+    def observe(self, interval: float):
+        """Добавление одного интервала обслуживания"""
+        self.mean = interval if self.mean is None else self.mean + self.alpha * (interval - self.mean)
+        self.samples += 1
+        self.sketch.add(interval)
+        if self.sketch.count > 2 * self.window:
+            self.sketch.scale(0.5)
+
+    def ready(self) -> bool:
+        """Достаточно ли наблюдений для оценки"""
+        return self.samples >= self.min_samples
+
+    def estimate(self, ahead: int, now: float):
+        """Ожидание, пока пройдут ahead студентов: (оценка, нижняя граница, верхняя) в секундах.
+
+        Разброс одного интервала берётся из 10-го и 90-го процентилей и для
+        суммы ahead интервалов растёт как корень из ahead. Студент в начале
+        очереди уже сдаёт: прошедшее с последнего /next время вычитается.
+        """
+        if not self.ready():
+            return None
+        if ahead <= 0:
+            return 0.0, 0.0, 0.0
+        elapsed = now - self.last if self.last is not None else 0.0
+        expected = max(ahead * self.mean - min(elapsed, self.mean), 0.0)
+        spread = math.sqrt(ahead)
+        low = expected - spread * max(self.mean - self.sketch.quantile(0.1), 0.0)
+        high = expected + spread * max(self.sketch.quantile(0.9) - self.mean, 0.0)
+        return expected, max(low, 0.0), high
+
+    def merge(self, other: 'ServiceTimes'):
+        """Объединение со статистикой той же очереди, накопленной отдельно (например, до перезапуска)"""
+        if other.mean is not None:
+            if self.mean is None:
+                self.mean = other.mean
+            else:
+                self.mean = (self.mean * self.samples + other.mean * other.samples) / (self.samples + other.samples)
+        self.samples += other.samples
+        self.sketch.merge(other.sketch)
+        if other.last is not None and (self.last is None or other.last > self.last):
+            self.last = other.last
+
+    def to_dict(self) -> dict:
+        return {'mean': self.mean, 'samples': self.samples, 'last': self.last, 'sketch': self.sketch.to_dict()}
+
+    def load(self, data: dict):
+        """Загрузка статистики, сохранённой to_dict"""
+        saved = ServiceTimes(self.alpha, self.window, self.max_gap, self.min_samples)
+        saved.mean, saved.samples, saved.last = data['mean'], data['samples'], data['last']
+        saved.sketch = QuantileSketch.from_dict(data['sketch'])
+        self.merge(saved)
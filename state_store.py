@@ -0,0 +1,94 @@
+"""Состояния многошаговых диалогов с пользователями"""
+import time
+from collections import OrderedDict
+
+
+class StateStore:
+    """Текущий шаг диалога каждого пользователя: имя состояния и данные к нему.
+
+    Запись живёт ttl секунд и удаляется при первом обращении после истечения.
+    Записей не больше max_size: при переполнении вытесняются давно не
+    использованные, поэтому брошенные на полпути диалоги не копятся в памяти.
+    """
+
+    def __init__(self, ttl: float = 600, max_size: int = 10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        # key -> (состояние, данные, момент истечения); порядок — от давно использованных
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        self._purge()
+        return len(self._entries)
+
+    def set(self, key, state: str, data=None, ttl: float = None):
+        """Перевести диалог key в состояние state"""
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._entries[key] = (state, data, expires)
+        self._entries.move_to_end(key)
+        self._purge()
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _live(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[2] <= time.monotonic():
+            del self._entries[key]
+            return None
+        return entry
+
+    def get(self, key, state: str = None):
+        """Данные диалога key, если он в состоянии state (или в любом, если state не задан)"""
+        entry = self._live(key)
+        if entry is None or (state is not None and entry[0] != state):
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def state(self, key):
+        """Имя текущего состояния диалога key или None"""
+        entry = self._live(key)
+        return entry[0] if entry else None
+
+    def pop(self, key, state: str = None):
+        """Забрать данные и завершить диалог; None, если диалога в состоянии state нет.
+
+        Забор атомарен для event loop: из двух параллельных сообщений шаг выполнит только одно.
+        """
+        entry = self._live(key)
+        if entry is None or (state is not None and entry[0] != state):
+            return None
+        del self._entries[key]
+        return entry[1]
+
+    def discard(self, key):
+        """Прервать диалог key"""
+        self._entries.pop(key, None)
+
+    def dump(self):
+        """Живые диалоги для сохранения при перезапуске: [(key, состояние, данные, секунд до истечения)]"""
+        now = time.monotonic()
+        return [(key, state, data, expires - now) for key, (state, data, expires) in self._entries.items()
+                if expires > now]
+
+    def restore(self, entries, elapsed: float = 0):
+        """Восстановление диалогов из dump(); elapsed — сколько секунд прошло с сохранения"""
+        for key, state, data, ttl in entries:
+            if ttl > elapsed:
+                self.set(key, state, data, ttl - elapsed)
+
+    def count(self, state: str) -> int:
+        """Сколько живых диалогов в состоянии state"""
+        now = time.monotonic()
+        return sum(1 for entry_state, _, expires in self._entries.values() if entry_state == state and expires > now)
+
+    def _purge(self):
+        """Удаление истёкших записей с начала порядка; дальше — при обращении"""
+        now = time.monotonic()
+        while self._entries:
+            key, (_, _, expires) = next(iter(self._entries.items()))
+            if expires > now:
+                break
+            del self._entries[key]
@@ -0,0 +1,486 @@
+"""Хранилища очереди студентов"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировки нет, остаётся только сверка версий
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class StaleVersion(Exception):
+    """Очередь в хранилище изменил другой экземпляр бота: запись по устаревшей версии отклонена"""
+
+
+class VersionFile:
+    """Номер версии сохранённой очереди в файле path; на этом же файле берётся блокировка (flock).
+
+    Каждая запись в хранилище увеличивает номер на единицу. Пишут под
+    исключительной блокировкой, читают снимок под разделяемой; сам номер
+    можно прочитать без блокировки, чтобы быстро узнать, изменилась ли очередь.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @contextmanager
+    def locked(self, exclusive: bool = True):
+        """Блокировка файла версии; внутри блока можно читать и записывать номер"""
+        # Каждый раз новый дескриптор: flock одного дескриптора из двух потоков не исключает друг друга.
+        # Без O_APPEND: иначе pwrite в Linux дописывает в конец, а не в начало файла
+        with os.fdopen(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644), 'r+b') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield f
+
+    @staticmethod
+    def _parse(data: bytes) -> int:
+        try:
+            return int(data)
+        except ValueError:
+            return 0
+
+    def read(self, f=None) -> int:
+        """Текущий номер версии (0, если очередь ещё не записывалась)"""
+        if f is not None:
+            return self._parse(os.pread(f.fileno(), 32, 0))
+        try:
+            with open(self.path, 'rb') as f:
+                return self._parse(f.read(32))
+        except FileNotFoundError:
+            return 0
+
+    @staticmethod
+    def write(f, version: int):
+        # Номер фиксированной ширины: читатель без блокировки не увидит его наполовину обрезанным
+        os.pwrite(f.fileno(), b"%020d\n" % version, 0)
+
+
+class QueueStorage:
+    """Интерфейс хранилища очереди.
+
+    Изменения очереди передаются хранилищу записями вида
+    {'op': 'add', 'student': {...}}, {'op': 'remove', 'index': i, 'user_id': ...}
+    и {'op': 'move', 'index': i, 'to': j, 'user_id': ...}.
+    Методы write и close могут вызываться из потока записи, остальные — из event loop.
+
+    version — номер версии, на которой основана очередь в памяти. Если с одним
+    хранилищем работают несколько экземпляров бота, write отклоняет запись
+    исключением StaleVersion, когда номер в хранилище ушёл вперёд.
+    """
+
+    version = 0
+
+    def load(self):
+        """Загрузка очереди: список студентов и записи, которые нужно к нему применить"""
+        raise NotImplementedError
+
+    def current_version(self) -> int:
+        """Номер версии в хранилище сейчас; больше version — очередь изменил другой экземпляр"""
+        return self.version
+
+    def load_changes(self):
+        """Записи, сделанные другими экземплярами после version, или None, если нужна полная загрузка"""
+        return []
+
+    def prepare(self, record_count: int, queue_length: int, force: bool = False) -> bool:
+        """Нужен ли для следующей пачки полный снимок очереди вместо отдельных записей"""
+        return force
+
+    def backlog(self) -> int:
+        """Сколько записей придётся применить к снимку при следующей загрузке"""
+        return 0
+
+    def write(self, records, snapshot):
+        """Запись пачки изменений или, если snapshot не None, полного снимка"""
+        raise NotImplementedError
+
+    def invalidate(self):
+        """Сохранённые изменения не удалось применить: следующая запись должна быть снимком"""
+
+    def close(self):
+        """Освобождение файлов и соединений"""
+
+
+def _apply_to_list(students, record):
+    """Применение записи журнала к обычному списку (для разовых миграций)"""
+    if record['op'] == 'add':
+        students.append(record['student'])
+    elif record['op'] == 'remove':
+        del students[record['index']]
+    elif record['op'] == 'move':
+        students.insert(record['to'], students.pop(record['index']))
+
+
+class JsonFileStorage(QueueStorage):
+    """Очередь в JSON-файле (формат queue.json) с журналом изменений.
+
+    Каждое изменение дописывается одной строкой в журнал, а сам файл
+    перезаписывается целиком только при периодическом сжатии журнала.
+    """
+
+    def __init__(self, filename: str, journal: bool = True, compact_every: int = 1000):
+        self.filename = filename
+        self.journal_file = f"{filename}.journal"
+        self.journal = journal
+        self.compact_every = compact_every
+        self.versions = VersionFile(f"{filename}.lock")
+        self.version = 0
+        self._journal = None
+        self._journal_records = 0
+        self._journal_ready = False
+        # Какой файл журнала и до какого байта прочитан (или записан) этим экземпляром
+        self._journal_inode = None
+        self._journal_offset = 0
+
+    def load(self):
+        # Повторная загрузка после изменений другого экземпляра начинает журнал заново
+        self.close()
+        self._journal_ready = False
+        self._journal_records = 0
+        self._journal_inode = None
+        with self.versions.locked(exclusive=False) as lock:
+            self.version = self.versions.read(lock)
+            try:
+                if not os.path.exists(self.filename):
+                    return [], []
+                with open(self.filename, 'rb') as f:
+                    data = f.read()
+                students = json.loads(data.decode('utf-8'))
+            except Exception as e:
+                logger.error(f"Ошибка загрузки очереди: {e}")
+                # Сохраняем повреждённый файл, чтобы следующая запись его не затёрла
+                if os.path.exists(self.filename):
+                    os.replace(self.filename, f"{self.filename}.broken")
+                return [], []
+            return students, self._read_journal(hashlib.sha1(data).hexdigest())
+
+    def current_version(self) -> int:
+        try:
+            return self.versions.read()
+        except OSError:
+            return self.version
+
+    def load_changes(self):
+        with self.versions.locked(exclusive=False) as lock:
+            version = self.versions.read(lock)
+            if version == self.version:
+                return []
+            # Журнал тот же (снимок не переписывался) — дочитываем только новые строки
+            try:
+                with open(self.journal_file, 'rb') as f:
+                    if os.fstat(f.fileno()).st_ino != self._journal_inode:
+                        return None
+                    f.seek(self._journal_offset)
+                    records = [json.loads(line) for line in f]
+                    offset = f.tell()
+            except (OSError, ValueError):
+                return None
+            self.version = version
+            self._journal_offset = offset
+            self._journal_records += len(records)
+            return records
+
+    def _read_journal(self, digest: str):
+        """Чтение журнала, относящегося к снимку с хешем digest"""
+        if not os.path.exists(self.journal_file):
+            return []
+
+        records = []
+        with open(self.journal_file, 'r', encoding='utf-8') as f:
+            header = f.readline()
+            try:
+                if json.loads(header).get('snapshot') != digest:
+                    return []
+            except ValueError:
+                return []
+
+            intact = True
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # Недописанная последняя строка после сбоя
+                    logger.warning("Пропущена повреждённая запись журнала очереди")
+                    intact = False
+                    break
+            if intact:
+                self._journal_inode = os.fstat(f.fileno()).st_ino
+                self._journal_offset = os.fstat(f.fileno()).st_size
+
+        # После повреждённой записи дописывать нельзя: первое же изменение сожмёт журнал
+        self._journal_ready = intact
+        self._journal_records = len(records)
+        if records:
+            logger.info(f"Из журнала восстановлено изменений очереди: {len(records)}")
+        return records
+
+    def prepare(self, record_count: int, queue_length: int, force: bool = False) -> bool:
+        # Сжимаем журнал не чаще, чем раз в len(очереди) записей, чтобы цена записи оставалась O(1).
+        # Если журнала для текущего снимка ещё нет, снимок уже будет содержать эти изменения
+        if (force or not self.journal or not self._journal_ready
+                or self._journal_records + record_count >= max(self.compact_every, queue_length)):
+            self._journal_records = 0
+            self._journal_ready = self.journal
+            return True
+        self._journal_records += record_count
+        return False
+
+    def backlog(self) -> int:
+        return self._journal_records if self._journal_ready else 0
+
+    def write(self, records, snapshot):
+        if snapshot is None and not records:
+            return
+        with self.versions.locked() as lock:
+            version = self.versions.read(lock)
+            if version != self.version:
+                raise StaleVersion(self.filename)
+            # Сначала номер, потом данные: после сбоя между ними другие экземпляры лишний раз перечитают файл,
+            # но не примут новые данные за уже известные
+            self.version = version + 1
+            self.versions.write(lock, self.version)
+            if snapshot is not None:
+                self._write_snapshot(snapshot)
+            else:
+                self._append_journal(records)
+
+    def invalidate(self):
+        self._journal_ready = False
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def _append_journal(self, records):
+        """Дописывание записей в журнал одной операцией"""
+        try:
+            if self._journal is None:
+                self._journal = open(self.journal_file, 'a', encoding='utf-8')
+            self._journal.write(''.join(
+                json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n' for record in records
+            ))
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._journal_offset = os.fstat(self._journal.fileno()).st_size
+        except Exception as e:
+            logger.error(f"Ошибка записи журнала очереди: {e}")
+            # Журнал мог остаться с недописанной строкой: следующая запись сделает новый снимок
+            self._journal_ready = False
+
+    def _write_atomic(self, path: str, data: bytes):
+        """Запись файла через временный файл и переименование"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _write_snapshot(self, students):
+        """Запись снимка очереди и начало нового журнала"""
+        try:
+            data = json.dumps(students, ensure_ascii=False, indent=2).encode('utf-8')
+            digest = hashlib.sha1(data).hexdigest()
+            self.close()
+
+            if self.journal:
+                # Заголовок журнала ссылается на снимок: если процесс упадёт между двумя
+                # переименованиями, старый журнал не совпадёт с новым снимком и будет пропущен
+                header = json.dumps({'snapshot': digest}) + '\n'
+                journal_tmp = f"{self.journal_file}.tmp"
+                with open(journal_tmp, 'w', encoding='utf-8') as f:
+                    f.write(header)
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._write_atomic(self.filename, data)
+                os.replace(journal_tmp, self.journal_file)
+                self._journal_inode = os.stat(self.journal_file).st_ino
+                self._journal_offset = len(header.encode('utf-8'))
+            else:
+                self._write_atomic(self.filename, data)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения очереди: {e}")
+            self._journal_ready = False
+
+
+class SQLiteStorage(QueueStorage):
+    """Очередь в базе SQLite (режим WAL).
+
+    Порядок очереди задаётся первичным ключом pos, для поиска по user_id есть
+    отдельный индекс, поэтому каждое изменение затрагивает одну строку.
+    При создании базы в неё один раз импортируется import_file (формат queue.json);
+    отметка об импорте хранится в PRAGMA user_version, поэтому опустевшая очередь
+    после перезапуска остаётся пустой.
+    Очередь по-прежнему целиком загружается в StudentQueue при старте: база
+    избавляет от разбора и переписывания файла, но не от копии очереди в памяти.
+    """
+
+    # user_version базы после импорта import_file
+    IMPORTED = 1
+
+    def __init__(self, filename: str, import_file: str = None):
+        self.filename = filename
+        self.import_file = import_file
+        self.versions = VersionFile(f"{filename}.lock")
+        self.version = 0
+        # False после неудачной записи: строки в базе не совпадают с очередью в памяти
+        self._rows_ready = True
+        self._conn = sqlite3.connect(filename, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        existed = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'students'"
+        ).fetchone() is not None
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS students ("
+            "pos INTEGER PRIMARY KEY, user_id INTEGER, username TEXT, first_name TEXT, surname TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS students_user_id ON students (user_id)")
+        if existed and not self._imported():
+            # База создана до отметки об импорте: импорт в неё уже выполнялся
+            self._mark_imported()
+
+    def load(self):
+        with self.versions.locked(exclusive=False) as lock:
+            self.version = self.versions.read(lock)
+            students = self._select_all(self._conn)
+        if not students and not self._imported():
+            if self.import_file and os.path.exists(self.import_file):
+                return self._import(), []
+            self._mark_imported()
+        return students, []
+
+    def _imported(self) -> bool:
+        """Выполнен ли перенос из import_file (или он не понадобился)"""
+        return self._conn.execute("PRAGMA user_version").fetchone()[0] >= self.IMPORTED
+
+    def _mark_imported(self):
+        self._conn.execute(f"PRAGMA user_version = {self.IMPORTED}")
+
+    def current_version(self) -> int:
+        try:
+            return self.versions.read()
+        except OSError:
+            return self.version
+
+    def load_changes(self):
+        # Строки меняются на месте, журнала нет: при любом чужом изменении очередь читается целиком
+        return [] if self.current_version() == self.version else None
+
+    @staticmethod
+    def _select_all(cur):
+        return [
+            {'user_id': user_id, 'username': username, 'first_name': first_name, 'surname': surname}
+            for user_id, username, first_name, surname in cur.execute(
+                "SELECT user_id, username, first_name, surname FROM students ORDER BY pos"
+            )
+        ]
+
+    @staticmethod
+    def _replace_all(cur, students):
+        cur.execute("DELETE FROM students")
+        cur.executemany(
+            "INSERT INTO students (pos, user_id, username, first_name, surname) VALUES (?, ?, ?, ?, ?)",
+            [(pos, s.get('user_id'), s.get('username'), s.get('first_name'), s.get('surname', ""))
+             for pos, s in enumerate(students, 1)]
+        )
+
+    def _import(self):
+        """Перенос очереди из queue.json и его журнала в пустую базу"""
+        students, records = JsonFileStorage(self.import_file).load()
+        for record in records:
+            _apply_to_list(students, record)
+        # Старые записи без фамилии (та же миграция, что и migrate_old_data)
+        for student in students:
+            student.setdefault('surname', "")
+        try:
+            self.write([], students)
+        except StaleVersion:
+            # Другой экземпляр бота успел перенести очередь раньше
+            return self.load()[0]
+        if not self._rows_ready:
+            # Запись не удалась: при следующем запуске перенос повторится
+            return students
+        self._mark_imported()
+        logger.info(f"Импортировано студентов из {self.import_file}: {len(students)}")
+        return students
+
+    def prepare(self, record_count: int, queue_length: int, force: bool = False) -> bool:
+        # После неудачной записи отдельные записи уже не с чем совмещать: нужна полная перезапись
+        if force or not self._rows_ready:
+            self._rows_ready = True
+            return True
+        return False
+
+    def write(self, records, snapshot):
+        if snapshot is None and not records:
+            return
+        with self.versions.locked() as lock:
+            version = self.versions.read(lock)
+            if version != self.version:
+                raise StaleVersion(self.filename)
+            self.version = version + 1
+            self.versions.write(lock, self.version)
+            self._write_rows(records, snapshot)
+
+    def invalidate(self):
+        self._rows_ready = False
+
+    def _write_rows(self, records, snapshot):
+        try:
+            with self._transaction() as cur:
+                if snapshot is not None:
+                    self._replace_all(cur, snapshot)
+                    return
+                for record in records:
+                    self._write_record(cur, record)
+        except Exception as e:
+            logger.error(f"Ошибка записи очереди в SQLite: {e}")
+            # Транзакция откатилась, а номер версии уже увеличен: следующая запись перепишет очередь целиком
+            self._rows_ready = False
+
+    def _write_record(self, cur, record):
+        if record['op'] == 'add':
+            s = record['student']
+            cur.execute(
+                "INSERT INTO students (user_id, username, first_name, surname) VALUES (?, ?, ?, ?)",
+                (s.get('user_id'), s.get('username'), s.get('first_name'), s.get('surname', ""))
+            )
+        elif record['op'] == 'remove':
+            if record.get('user_id') is not None:
+                cur.execute(
+                    "DELETE FROM students WHERE pos = (SELECT MIN(pos) FROM students WHERE user_id = ?)",
+                    (record['user_id'],)
+                )
+            else:
+                cur.execute(
+                    "DELETE FROM students WHERE pos = (SELECT pos FROM students ORDER BY pos LIMIT 1 OFFSET ?)",
+                    (record['index'],)
+                )
+        elif record['op'] == 'move':
+            # Порядок задаётся pos, поэтому перемещение перенумеровывает всю очередь
+            students = self._select_all(cur)
+            _apply_to_list(students, record)
+            self._replace_all(cur, students)
+
+    @contextmanager
+    def _transaction(self):
+        """BEGIN/COMMIT вокруг блока с откатом при ошибке"""
+        self._conn.execute("BEGIN")
+        try:
+            yield self._conn.cursor()
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,81 @@
+"""Проверка нескольких экземпляров бота на одном хранилище очереди.
+
+Запускает несколько процессов, которые одновременно ставят в очередь и убирают
+из неё своих студентов через актор и фоновую запись, как обработчики бота.
+В конце очередь на диске должна совпасть с объединением того, что каждый
+процесс считает своим: ни одно изменение не потеряно и не задвоено.
+
+Запуск: python stress_instances.py [json|sqlite] [процессов] [операций]
+"""
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+
+os.environ.setdefault('METRICS_PORT', '0')
+
+from main import StudentQueue
+from persistence import PersistenceWorker
+from queue_actor import QueueActor
+from storage import JsonFileStorage, SQLiteStorage
+
+
+def make_storage(kind: str, directory: str):
+    if kind == "sqlite":
+        return SQLiteStorage(os.path.join(directory, "queue.sqlite3"))
+    return JsonFileStorage(os.path.join(directory, "queue.json"))
+
+
+async def worker(kind: str, directory: str, base: int, ops: int):
+    """Один экземпляр: случайные join/leave своих user_id; печатает, кто из них остался в очереди"""
+    writer = PersistenceWorker(0.01)
+    queue = StudentQueue(make_storage(kind, directory), writer)
+    actor = QueueActor(queue)
+    rng = random.Random(base)
+    mine = set()
+    for _ in range(ops):
+        user_id = base + rng.randrange(100)
+        if user_id in mine:
+            if await actor.call('remove_student', user_id):
+                mine.discard(user_id)
+        elif await actor.call('add_student', user_id, f"user{user_id}", "Имя", f"Фамилия{user_id}"):
+            mine.add(user_id)
+        await asyncio.sleep(rng.random() * 0.002)
+    await actor.stop()
+    await writer.flush()
+    print(json.dumps(sorted(mine)))
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--worker":
+        kind, directory, base, ops = sys.argv[2], sys.argv[3], int(sys.argv[4]), int(sys.argv[5])
+        asyncio.run(worker(kind, directory, base, ops))
+        return
+
+    kind = sys.argv[1] if len(sys.argv) > 1 else "json"
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    ops = int(sys.argv[3]) if len(sys.argv) > 3 else 500
+    with tempfile.TemporaryDirectory() as directory:
+        workers = [
+            subprocess.Popen([sys.executable, __file__, "--worker", kind, directory, str(base), str(ops)],
+                             stdout=subprocess.PIPE, text=True)
+            for base in range(1000, 1000 * (processes + 1), 1000)
+        ]
+        expected = set()
+        for process in workers:
+            out, _ = process.communicate()
+            expected.update(json.loads(out.splitlines()[-1]))
+
+        stored = [student.user_id for student in StudentQueue(make_storage(kind, directory)).view()]
+        lost, extra = expected - set(stored), set(stored) - expected
+        duplicates = len(stored) - len(set(stored))
+        print(f"{kind}: процессов {processes}, в очереди {len(stored)}, ожидалось {len(expected)}, "
+              f"потеряно {len(lost)}, лишних {len(extra)}, повторов {duplicates}")
+        sys.exit(1 if lost or extra or duplicates else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Компактная запись студента в очереди"""
+import sys
+
+
+def _intern(value):
+    # Имена и фамилии часто повторяются: одна строка на все записи вместо копии в каждой
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def display_name(surname, first_name, username) -> str:
+    """Отображаемое имя студента"""
+    if surname:
+        return f"{surname} {first_name}"
+    return f"{first_name} ({username})"
+
+
+class Student:
+    """Запись очереди: поля формата queue.json и готовое отображаемое имя.
+
+    Вместо словаря на каждую запись — __slots__, повторяющиеся строки
+    интернируются, отображаемое имя вычисляется один раз при создании.
+    После создания запись не меняется, поэтому её можно отдавать в поток
+    записи и держать в нескольких индексах без копирования.
+    """
+
+    __slots__ = ('user_id', 'username', 'first_name', 'surname', 'display_name')
+
+    def __init__(self, user_id, username, first_name, surname=""):
+        self.user_id = user_id
+        self.username = username
+        self.first_name = _intern(first_name)
+        self.surname = _intern(surname)
+        self.display_name = display_name(surname, first_name, username)
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """Запись из элемента queue.json (у старых записей нет фамилии)"""
+        return cls(data.get('user_id'), data.get('username'), data.get('first_name'), data.get('surname') or "")
+
+    def to_dict(self) -> dict:
+        """Элемент queue.json"""
+        return {
+            'user_id': self.user_id,
+            'username': self.username,
+            'first_name': self.first_name,
+            'surname': self.surname
+        }
+
+    def __eq__(self, other):
+        if not isinstance(other, Student):
+            return NotImplemented
+        return (self.user_id, self.username, self.first_name, self.surname) == \
+            (other.user_id, other.username, other.first_name, other.surname)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"Student({self.user_id!r}, {self.username!r}, {self.first_name!r}, {self.surname!r})"
@@ -0,0 +1,100 @@
+"""Приём обновлений Telegram через webhook вместо long polling"""
+import asyncio
+import hmac
+import json
+import logging
+import signal
+
+from telegram import Update
+from telegram.ext import Application
+
+import metrics
+from http_server import HttpServer
+
+logger = logging.getLogger(__name__)
+
+# Заголовок, в котором Telegram присылает секрет, указанный в setWebhook
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+
+WEBHOOK_REQUESTS = metrics.counter('queue_bot_webhook_requests_total', "Запросы к webhook по результату", ('result',))
+
+
+class WebhookReceiver:
+    """HTTP-приёмник обновлений: проверяет секрет и кладёт Update в очередь Application.
+
+    Ответ Telegram отправляется сразу после постановки в очередь, обработка
+    идёт так же, как при polling, — теми же обработчиками и с той же параллельностью.
+    """
+
+    def __init__(self, application: Application, host: str, port: int, path: str, secret: str,
+                 max_body: int = 1 << 20):
+        self.application = application
+        self.path = path
+        self.secret = secret
+        self.server = HttpServer(host, port, max_body)
+        self.server.route('POST', path, self.handle)
+
+    async def handle(self, request):
+        token = request.headers.get(SECRET_HEADER, "").encode('latin-1')
+        if not hmac.compare_digest(token, self.secret.encode()):
+            WEBHOOK_REQUESTS.inc(result='forbidden')
+            return 403, "text/plain", b''
+        try:
+            data = json.loads(request.body)
+            update = Update.de_json(data, self.application.bot) if isinstance(data, dict) else None
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Некорректное обновление в webhook: {e}")
+            update = None
+        if update is None:
+            WEBHOOK_REQUESTS.inc(result='invalid')
+            return 400, "text/plain", b''
+        await self.application.update_queue.put(update)
+        WEBHOOK_REQUESTS.inc(result='accepted')
+        return 200, "text/plain", b''
+
+    async def start(self):
+        await self.server.start()
+
+    async def stop(self):
+        await self.server.stop()
+
+
+async def serve_webhook(application: Application, receiver: WebhookReceiver, url: str = None,
+                        stop: asyncio.Event = None):
+    """Жизненный цикл приложения в режиме webhook — то же, что делает run_polling.
+
+    url — публичный адрес, который регистрируется в Telegram (без него webhook
+    должен быть настроен заранее); stop — событие остановки, по умолчанию SIGINT/SIGTERM.
+    """
+    if stop is None:
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+    await application.initialize()
+    try:
+        if application.post_init is not None:
+            await application.post_init(application)
+        await application.start()
+        await receiver.start()
+        try:
+            if url:
+                await application.bot.set_webhook(
+                    url=url, secret_token=receiver.secret, allowed_updates=Update.ALL_TYPES
+                )
+                logger.info(f"Webhook зарегистрирован: {url}")
+            await stop.wait()
+        finally:
+            # Сначала перестаём принимать обновления, затем дорабатываем принятые
+            await receiver.stop()
+            await application.stop()
+            if application.post_stop is not None:
+                await application.post_stop(application)
+    finally:
+        await application.shutdown()
+        if application.post_shutdown is not None:
+            await application.post_shutdown(application)